@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from config import app_config
+
+# Priority classes, lower value is served first
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+DEFAULT_MAX_RUNNING = 2  # 同时执行的任务数
+DEFAULT_MAX_PENDING = 20  # 排队上限，超出返回429
+DEFAULT_INTERACTIVE_RESERVED = 1  # 为交互任务预留的执行槽位，批量任务不能占用
+DEFAULT_CLIENT_MAX_INFLIGHT = 3  # 每个客户端排队+执行中的任务上限
+WAIT_SAMPLES = 500
+DEFAULT_RUN_SECONDS = 60.0  # 估算Retry-After时的初始平均执行时长
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Ticket:
+    def __init__(self, controller, client_id: str, priority: str, bounded: bool):
+        self.controller = controller
+        self.client_id = client_id
+        self.priority = priority
+        self.bounded = bounded
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.released = False
+        self.admitted = asyncio.get_running_loop().create_future()
+
+    async def wait(self) -> float:
+        """Wait for a run slot; returns the time spent queued"""
+        try:
+            await asyncio.shield(self.admitted)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+        return self.started_at - self.enqueued_at
+
+    def release(self):
+        self.controller.release(self)
+
+class AdmissionController:
+    """Bounded, priority-ordered admission for agent runs"""
+
+    def __init__(self):
+        self._pending = []  # heap of (priority, seq, ticket)
+        self._seq = itertools.count()
+        self._running = {INTERACTIVE: 0, BATCH: 0}
+        self._inflight = {}  # client_id -> 排队+执行中的数量
+        self._waits = {INTERACTIVE: deque(maxlen=WAIT_SAMPLES), BATCH: deque(maxlen=WAIT_SAMPLES)}
+        self._admitted = {INTERACTIVE: 0, BATCH: 0}
+        self._rejected = {}
+        self._avg_run_seconds = DEFAULT_RUN_SECONDS
+
+    # 配置每次读取，保存配置后立即生效
+    @property
+    def max_running(self) -> int:
+        return max(int(app_config.get("maxConcurrentRuns", DEFAULT_MAX_RUNNING)), 1)
+
+    @property
+    def max_pending(self) -> int:
+        return int(app_config.get("maxPendingRuns", DEFAULT_MAX_PENDING))
+
+    @property
+    def interactive_reserved(self) -> int:
+        return min(int(app_config.get("interactiveReservedRuns", DEFAULT_INTERACTIVE_RESERVED)), self.max_running - 1)
+
+    @property
+    def client_max_inflight(self) -> int:
+        return int(app_config.get("clientMaxInflight", DEFAULT_CLIENT_MAX_INFLIGHT))
+
+    def _retry_after(self) -> int:
+        backlog = len(self._pending) + 1
+        return max(1, math.ceil(self._avg_run_seconds * backlog / self.max_running))
+
+    def _reject(self, reason: str):
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, self._retry_after())
+
+    def check(self, client_id: str):
+        """Raise AdmissionRejected if a bounded ticket for the client would be refused right now"""
+        if len([t for _, _, t in self._pending if t.bounded]) >= self.max_pending:
+            self._reject("queue_full")
+        if self._inflight.get(client_id, 0) >= self.client_max_inflight:
+            self._reject("client_limit")
+
+    def enqueue(self, client_id: str, priority: str = INTERACTIVE, bounded: bool = True) -> Ticket:
+        """Queue a run or raise AdmissionRejected; unbounded tickets (internal workers) skip the caps"""
+        if priority not in PRIORITIES:
+            priority = INTERACTIVE
+        if bounded:
+            self.check(client_id)
+
+        ticket = Ticket(self, client_id, priority, bounded)
+        self._inflight[client_id] = self._inflight.get(client_id, 0) + 1
+        heapq.heappush(self._pending, (PRIORITIES[priority], next(self._seq), ticket))
+        self._dispatch()
+        return ticket
+
+    def _has_slot(self, priority: str) -> bool:
+        running = sum(self._running.values())
+        if running >= self.max_running:
+            return False
+        if priority == BATCH:
+            return self._running[BATCH] < self.max_running - self.interactive_reserved
+        return True
+
+    def _dispatch(self):
+        # 堆顶是优先级最高、最早排队的任务；批量任务没有槽位时不阻塞后面的交互任务
+        deferred = []
+        while self._pending:
+            item = heapq.heappop(self._pending)
+            ticket = item[2]
+            if ticket.released:
+                continue
+            if not self._has_slot(ticket.priority):
+                deferred.append(item)
+                if sum(self._running.values()) >= self.max_running:
+                    break
+                continue
+            ticket.started_at = time.monotonic()
+            self._running[ticket.priority] += 1
+            self._admitted[ticket.priority] += 1
+            self._waits[ticket.priority].append(ticket.started_at - ticket.enqueued_at)
+            ticket.admitted.set_result(True)
+        for item in deferred:
+            heapq.heappush(self._pending, item)
+
+    def release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        self._inflight[ticket.client_id] -= 1
+        if not self._inflight[ticket.client_id]:
+            del self._inflight[ticket.client_id]
+        if ticket.started_at is not None:
+            self._running[ticket.priority] -= 1
+            duration = time.monotonic() - ticket.started_at
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * duration
+        else:
+            self._pending = [item for item in self._pending if item[2] is not ticket]
+            heapq.heapify(self._pending)
+            if not ticket.admitted.done():
+                ticket.admitted.cancel()
+        self._dispatch()
+
+    def metrics(self) -> dict:
+        def summarize(samples):
+            if not samples:
+                return {"count": 0, "p50": None, "p95": None, "max": None}
+            ordered = sorted(samples)
+            return {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+
+        pending = {INTERACTIVE: 0, BATCH: 0}
+        for _, _, ticket in self._pending:
+            pending[ticket.priority] += 1
+        return {
+            "limits": {
+                "max_running": self.max_running,
+                "max_pending": self.max_pending,
+                "interactive_reserved": self.interactive_reserved,
+                "client_max_inflight": self.client_max_inflight,
+            },
+            "running": dict(self._running),
+            "pending": pending,
+            "admitted": dict(self._admitted),
+            "rejected": dict(self._rejected),
+            "queue_wait_seconds": {priority: summarize(samples) for priority, samples in self._waits.items()},
+            "avg_run_seconds": self._avg_run_seconds,
+        }
+
+controller = AdmissionController()
@@ -1,11 +1,13 @@
 import asyncio
 import queue
-import json
-from fastapi import APIRouter, HTTPException
+import uuid
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import action
+import admission
 import log
+import profiles
 import db
 
 router = APIRouter()
@@ -14,6 +16,24 @@ router = APIRouter()
 class ActionRequest(BaseModel):
     action: str
     scenario: str = None
+    priority: str = admission.INTERACTIVE  # interactive / batch
+    run_id: str = None  # 传入之前的run_id并设置resume，从最后一个已验证的阶段继续
+    resume: bool = False
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """StreamingResponse that always closes its generator and calls on_close, even if streaming never started"""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 客户端断开后生成器不会被继续迭代，主动关闭以执行其中的清理逻辑
+            await self.body_iterator.aclose()
+            self.on_close()
 
 # 根端点
 @router.get("/")
@@ -21,35 +41,83 @@ async def root():
     """根端点"""
     return {"message": "DroidRun API is running"}
 
+# 就绪检查端点
+@router.get("/ready")
+async def readiness():
+    """报告droidrun是否已预热（warm）或仍需在首次执行时导入（cold）"""
+    droidrun_status = action.get_droidrun_status()
+    return {"ready": droidrun_status["state"] == "warm", "droidrun": droidrun_status}
+
+# 场景配置端点
+@router.get("/profiles")
+async def list_profiles():
+    """列出场景配置及其提示词token数"""
+    # 首次调用会加载tokenizer，放到线程中执行
+    return await asyncio.to_thread(profiles.list_profiles)
+
+# 准入控制指标
+@router.get("/metrics/admission")
+async def admission_metrics():
+    """运行/排队数量、拒绝次数和排队等待时间"""
+    return admission.controller.metrics()
+
 # 动作执行端点
 @router.post("/stream-execute")
-async def stream_execute_action(request: ActionRequest):
+async def stream_execute_action(request: ActionRequest, http_request: Request):
     """执行手机动作并流式传输日志"""
     if not request.action.strip():
         raise HTTPException(status_code=400, detail="动作不能为空")
+
+    # 准入控制：超出容量时立即返回429，而不是无限制地启动任务
+    client_id = http_request.headers.get("X-Client-Id") or (http_request.client.host if http_request.client else "unknown")
+    try:
+        ticket = admission.controller.enqueue(client_id, request.priority)
+    except admission.AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙，请稍后重试 ({e.reason})",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     
     try:
         action_text = request.action.strip()
+        run_id = request.run_id or uuid.uuid4().hex
         
         # 创建日志队列和完成事件
         log_queue = asyncio.Queue()
         done_event = asyncio.Event()
         
-        # 创建执行动作的任务
-        execution_task = asyncio.create_task(
-            action.stream_execute_droidrun_action(action_text, log_queue, done_event, request.scenario)
-        )
-        
         async def generate_logs():
             """生成可用的日志"""
-            # 开始流式传输日志
-            async for log_line in log.log_generator(log_queue, done_event):
-                # 包装成JSON格式并添加SSE前缀
-                log_json = {"log": log_line}
-                yield f"data: {json.dumps(log_json)}\n\n"
-            
-            # 等待执行完成
-            result = await execution_task
+            execution_task = None
+            try:
+                # 先告知客户端run_id，用于失败后恢复执行
+                yield f"data: {log.dumps({'run_id': run_id})}\n\n"
+
+                # 排队等待执行槽位
+                if not ticket.admitted.done():
+                    yield f"data: {log.dumps({'logs': ['[等待] 任务排队中...']})}\n\n"
+                await ticket.wait()
+
+                # 创建执行动作的任务
+                execution_task = asyncio.create_task(
+                    action.stream_execute_droidrun_action(
+                        action_text, log_queue, done_event, request.scenario, run_id, request.resume
+                    )
+                )
+
+                # 开始流式传输日志，按时间/大小合并成批次发送
+                async for event in log.sse_log_batches(log.log_generator(log_queue, done_event)):
+                    yield event
+                
+                # 等待执行完成
+                result = await execution_task
+            finally:
+                # 客户端断开时先停止智能体，再把执行槽位交给下一个任务
+                if execution_task and not execution_task.done():
+                    execution_task.cancel()
+                    await asyncio.gather(execution_task, return_exceptions=True)
+                ticket.release()
             
             # 保存到历史记录
             db.add_history(
@@ -59,8 +127,9 @@ async def stream_execute_action(request: ActionRequest):
             )
         
         # 启动流式响应
-        return StreamingResponse(
+        return ReleasingStreamingResponse(
             generate_logs(),
+            on_close=ticket.release,
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -68,4 +137,5 @@ async def stream_execute_action(request: ActionRequest):
             },
         )
     except Exception as e:
+        ticket.release()
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
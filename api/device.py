@@ -1,9 +1,45 @@
-from fastapi import APIRouter, Body, HTTPException
+import json
+import asyncio
+from fastapi import APIRouter, Body, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 import device
 import portal
+import console
+import uitree
+import health
 
 router = APIRouter()
 
+# 批量安装Portal请求模型
+class FleetInstallRequest(BaseModel):
+    device_ids: list[str] = None
+    portal_path: str = None
+    force: bool = False
+    concurrency: int = portal.FLEET_INSTALL_CONCURRENCY
+
+# 流式ADB控制台请求模型
+class ConsoleRequest(BaseModel):
+    device_id: str = None
+    commands: list[str]
+    timeout: float = console.DEFAULT_TIMEOUT
+
+def _resolve_console_device(device_id: str = None) -> str:
+    if device_id:
+        return device_id
+    devices = device.get_connected_devices()
+    if not devices:
+        raise HTTPException(status_code=400, detail="No device connected")
+    return devices[0]
+
+def _check_console_command(command: str) -> str:
+    command = console.strip_shell_prefix(command)
+    if not command:
+        raise HTTPException(status_code=400, detail="Command cannot be empty")
+    if device.is_dangerous_command(command):
+        raise HTTPException(status_code=400, detail="Dangerous command not allowed")
+    return command
+
 # Device management endpoints
 @router.get("/devices")
 async def list_devices():
@@ -18,12 +54,39 @@ async def get_device_status():
 @router.post("/device/connect")
 async def connect_device(connection_data: dict = Body(None)):
     """Connect to Android device via USB or WiFi"""
-    return device.connect_device(connection_data)
+    result = device.connect_device(connection_data)
+    # WiFi设备交给健康监控保持连接
+    if connection_data and connection_data.get('type') == 'wifi' and connection_data.get('ip_address'):
+        health.track_wifi_device(connection_data['ip_address'])
+    return result
 
 @router.post("/device/disconnect")
 async def disconnect_device(device_id: str = None):
     """Disconnect from Android device"""
-    return device.disconnect_device(device_id)
+    result = device.disconnect_device(device_id)
+    # 主动断开的设备不再自动重连
+    health.untrack_wifi_device(device_id)
+    return result
+
+# Device health endpoints
+@router.get("/devices/health")
+async def list_device_health():
+    """Get the latest health status of every monitored device"""
+    return health.get_health()
+
+@router.get("/device/{device_id}/health")
+async def get_device_health(device_id: str, history: bool = True):
+    """Get a device's health status and sample history"""
+    result = health.get_health(device_id, include_history=history)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Device not monitored")
+    return result
+
+@router.post("/devices/health/check")
+async def run_health_check():
+    """Run a health sweep immediately"""
+    await health.check_once()
+    return health.get_health()
 
 @router.get("/device/screenshot")
 async def take_screenshot():
@@ -33,10 +96,141 @@ async def take_screenshot():
 @router.post("/device/adb")
 async def execute_adb_command_endpoint(command_data: dict):
     """Execute arbitrary ADB command"""
-    return device.execute_adb_command_endpoint(command_data)
+    result = device.execute_adb_command_endpoint(command_data)
+    # 命令可能改变了界面
+    uitree.invalidate()
+    return result
+
+@router.post("/device/adb/stream")
+async def stream_adb_commands(request: ConsoleRequest):
+    """Pipeline shell commands through a dedicated adb shell and stream output"""
+    device_id = _resolve_console_device(request.device_id)
+    commands = [_check_console_command(command) for command in request.commands]
+    try:
+        session = await console.open_session(device_id)
+    except console.ConsoleError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        # 所有命令一次性写入，输出按顺序流回
+        submitted = [await session.submit(command) for command in commands]
+    except console.ConsoleError as e:
+        await session.close()
+        raise HTTPException(status_code=500, detail=str(e))
+    uitree.invalidate(device_id)
+
+    async def generate_output():
+        try:
+            for index, pending in enumerate(submitted):
+                async for kind, value in session.stream(pending, request.timeout):
+                    event = {"id": index, "type": kind, "data": value}
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            # 客户端提前断开时结束本请求的会话，未完成的命令随之终止
+            await session.close()
+
+    return StreamingResponse(
+        generate_output(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        },
+    )
+
+@router.websocket("/device/{device_id}/console")
+async def adb_console(websocket: WebSocket, device_id: str):
+    """Interactive console: each message {"command", "timeout"} runs in this connection's adb shell"""
+    await websocket.accept()
+    try:
+        session = await console.open_session(device_id)
+    except console.ConsoleError as e:
+        await websocket.send_json({"type": "error", "data": str(e)})
+        await websocket.close()
+        return
+
+    # 已提交但尚未输出完毕的命令，按提交顺序输出
+    submitted = asyncio.Queue()
+
+    async def send_output():
+        while True:
+            command_id, command_session, pending, timeout = await submitted.get()
+            async for kind, value in command_session.stream(pending, timeout):
+                await websocket.send_json({"id": command_id, "type": kind, "data": value})
+
+    sender = asyncio.create_task(send_output())
+    command_id = 0
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                command = _check_console_command(message.get("command", ""))
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "data": e.detail})
+                continue
+            # 超时后会话已关闭，为本连接重新启动一个
+            if not session.alive:
+                session = await console.open_session(device_id)
+            command_id += 1
+            pending = await session.submit(command)
+            uitree.invalidate(device_id)
+            await submitted.put((command_id, session, pending, float(message.get("timeout", console.DEFAULT_TIMEOUT))))
+            await websocket.send_json({"id": command_id, "type": "accepted", "data": command})
+    except (WebSocketDisconnect, console.ConsoleError):
+        pass
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        await session.close()
+
+# UI hierarchy endpoints
+@router.get("/device/{device_id}/ui")
+async def get_ui_hierarchy(device_id: str, max_age: float = uitree.DEFAULT_MAX_AGE):
+    """Get the cached, indexed UI hierarchy and its diff against the previous snapshot"""
+    try:
+        snapshot = await uitree.get_snapshot(device_id, max_age)
+    except uitree.UIError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**snapshot.to_dict(), "diff": uitree.get_diff(device_id)}
+
+@router.get("/device/{device_id}/ui/find")
+async def find_ui_elements(device_id: str, text: str = None, resource_id: str = None, exact: bool = True, max_age: float = uitree.DEFAULT_MAX_AGE):
+    """Find elements by text and/or resource id through the snapshot indexes"""
+    if not text and not resource_id:
+        raise HTTPException(status_code=400, detail="Provide text or resource_id")
+    try:
+        snapshot = await uitree.get_snapshot(device_id, max_age)
+    except uitree.UIError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"digest": snapshot.digest, "elements": snapshot.find(text, resource_id, exact)}
+
+@router.post("/device/{device_id}/ui/invalidate")
+async def invalidate_ui_hierarchy(device_id: str):
+    """Drop the cached snapshot so the next lookup re-reads the screen"""
+    uitree.invalidate(device_id)
+    return {"message": "UI cache invalidated"}
 
 # Portal installation endpoint
 @router.post("/device/install-portal")
 async def install_portal(portal_path: str = None):
     """Install DroidRun Portal app on device"""
-    return await portal.install_portal(portal_path)
\ No newline at end of file
+    return await portal.install_portal(portal_path)
+
+@router.post("/device/install-portal/fleet")
+async def install_portal_fleet(request: FleetInstallRequest = Body(None)):
+    """Install DroidRun Portal on many devices in parallel and stream per-device progress"""
+    request = request or FleetInstallRequest()
+
+    async def generate_progress():
+        async for event in portal.install_portal_fleet(
+            request.device_ids, request.portal_path, request.force, request.concurrency
+        ):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        generate_progress(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        },
+    )
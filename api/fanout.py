@@ -0,0 +1,114 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import admission
+import fanout
+import log
+
+router = APIRouter()
+
+FANOUT_BATCH_MAX_LINES = 100
+FANOUT_HEARTBEAT_INTERVAL = 15.0
+
+# 多设备执行请求模型
+class FanoutRequest(BaseModel):
+    action: str
+    scenario: str = None
+    devices: list[str] = None  # 指定设备，为空时按selector选择
+    selector: str = "healthy"  # healthy / all / wifi / usb
+    quorum: int = None  # 成功设备数达到后结束分组，其余设备停止
+    timeout: float = None  # 每台设备从开始执行起的最长秒数
+
+async def _group_events(group: fanout.FanoutGroup, queue: asyncio.Queue):
+    """SSE events for a group: device-tagged log batches, member results, then the aggregate"""
+    try:
+        yield f"data: {log.dumps({'group_id': group.group_id, 'devices': list(group.members)})}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=FANOUT_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                if group.finished.is_set():
+                    yield f"data: {log.dumps({'group': group.to_dict()})}\n\n"
+                    break
+                yield ": ping\n\n"
+                continue
+
+            # 合并队列中已有的日志，日志行带设备前缀
+            logs = []
+            while event and "log" in event:
+                logs.append(f"[{event['device']}] {event['log']}")
+                if queue.empty() or len(logs) >= FANOUT_BATCH_MAX_LINES:
+                    event = False
+                    break
+                event = queue.get_nowait()
+            if logs:
+                yield f"data: {log.dumps({'logs': logs})}\n\n"
+            if event is None:
+                break
+            if event:
+                yield f"data: {log.dumps(event)}\n\n"
+                if "group" in event:
+                    break
+    finally:
+        group.unsubscribe(queue)
+
+# Fan-out endpoints
+@router.post("/fanout")
+async def start_fanout(request: FanoutRequest, http_request: Request):
+    """Run one goal on several devices in parallel and stream tagged logs"""
+    action_text = request.action.strip()
+    if not action_text:
+        raise HTTPException(status_code=400, detail="动作不能为空")
+    try:
+        device_ids = fanout.select_devices(request.selector, request.devices)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not device_ids:
+        raise HTTPException(status_code=404, detail="没有符合条件的设备")
+
+    client_id = http_request.headers.get("X-Client-Id") or (http_request.client.host if http_request.client else "unknown")
+    # 分组成员使用独立的并发预算，这里只按排队上限和客户端上限做准入检查
+    try:
+        admission.controller.check(client_id)
+    except admission.AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙，请稍后重试 ({e.reason})",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    group = fanout.create_group(action_text, request.scenario, device_ids, request.quorum, request.timeout)
+    queue = group.subscribe()
+    group.start()
+    # 客户端断开后分组继续执行，结果可通过 GET /fanout/{group_id} 查询
+    return StreamingResponse(
+        _group_events(group, queue),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        },
+    )
+
+@router.get("/fanout")
+async def list_fanout_groups():
+    """List recent fan-out groups, newest first"""
+    return fanout.list_groups()
+
+@router.get("/fanout/{group_id}")
+async def get_fanout_group(group_id: str):
+    """Aggregated per-device result of a fan-out group"""
+    group = fanout.get_group(group_id)
+    if group is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group.to_dict()
+
+@router.delete("/fanout/{group_id}")
+async def cancel_fanout_group(group_id: str):
+    """Stop every device still running in the group"""
+    group = fanout.get_group(group_id)
+    if group is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    group.cancel()
+    return {"message": "Group cancelled"}
@@ -1,4 +1,10 @@
+import csv
+import io
+import json
+import zlib
+import datetime
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 import db
 
 router = APIRouter()
@@ -13,6 +19,67 @@ async def get_history_records():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _parse_bound(value: str, is_end: bool = False) -> str | None:
+    """Turn a date or datetime query parameter into an ISO timestamp bound"""
+    if not value:
+        return None
+    try:
+        if len(value) == 10:
+            day = datetime.date.fromisoformat(value)
+            # 只给日期时结束日期包含当天
+            if is_end:
+                day += datetime.timedelta(days=1)
+            return datetime.datetime.combine(day, datetime.time()).isoformat()
+        return datetime.datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+def _csv_chunks(chunks):
+    # 表头和数据行使用同一种换行符
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(("id", "action", "timestamp", "success", "reason"))
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerows((row[0], row[1], row[2], int(bool(row[3])), row[4] or "") for row in rows)
+        yield buffer.getvalue()
+
+def _jsonl_chunks(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps({"id": row[0], "action": row[1], "timestamp": row[2], "success": bool(row[3]), "reason": row[4]}, ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip 格式
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@router.get("/history/export")
+def export_history(format: str = "csv", gzip: bool = False, start: str = None, end: str = None, success: bool = None):
+    """Stream history rows as CSV or JSON Lines without loading the whole table"""
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+    chunks = db.iter_history(_parse_bound(start), _parse_bound(end, is_end=True), success)
+    body = _csv_chunks(chunks) if format == "csv" else _jsonl_chunks(chunks)
+    filename = f"history.{format}"
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    if gzip:
+        body = _gzip_chunks(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @router.delete("/history/{history_id}")
 async def delete_history_record(history_id: int):
     """Delete a specific history record"""
@@ -29,4 +96,40 @@ async def delete_all_history():
         db.delete_all_history()
         return {"message": "All history records deleted successfully"}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Macro endpoints
+@router.get("/macros")
+async def get_macros():
+    """Get all recorded macros"""
+    try:
+        return db.get_macros()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/macros/{macro_id}")
+async def delete_macro(macro_id: int):
+    """Delete a recorded macro so the goal runs through the agent again"""
+    try:
+        db.delete_macro(macro_id)
+        return {"message": "Macro deleted successfully"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Run checkpoint endpoints
+@router.get("/runs/{run_id}/checkpoints")
+async def get_run_checkpoints(run_id: str):
+    """Get the verified stages saved for a run"""
+    try:
+        return db.get_run_checkpoints(run_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/runs/{run_id}/checkpoints")
+async def delete_run_checkpoints(run_id: str):
+    """Discard a run's checkpoints so the next resume starts from scratch"""
+    try:
+        db.delete_run_checkpoints(run_id)
+        return {"message": "Checkpoints deleted successfully"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+import taskqueue
+
+router = APIRouter()
+
+# 任务提交模型
+class TaskRequest(BaseModel):
+    action: str
+    scenario: str = None
+    priority: int = 0
+    max_attempts: int = taskqueue.MAX_ATTEMPTS
+
+class TaskBatchRequest(BaseModel):
+    tasks: list[TaskRequest]
+
+# Task queue endpoints
+@router.post("/tasks")
+async def submit_task(request: TaskRequest):
+    """Enqueue a task in the persistent queue"""
+    if not request.action.strip():
+        raise HTTPException(status_code=400, detail="动作不能为空")
+    task_id = taskqueue.submit(request.action.strip(), request.scenario, request.priority, request.max_attempts)
+    return {"id": task_id, "status": taskqueue.QUEUED}
+
+@router.post("/tasks/batch")
+async def submit_tasks(request: TaskBatchRequest):
+    """Enqueue many tasks in one transaction"""
+    items = [task.model_dump() for task in request.tasks if task.action.strip()]
+    if not items:
+        raise HTTPException(status_code=400, detail="动作不能为空")
+    for item in items:
+        item["action"] = item["action"].strip()
+    ids = taskqueue.submit_many(items)
+    return {"ids": ids, "count": len(ids)}
+
+@router.get("/tasks")
+async def list_tasks(status: str = None, limit: int = 100):
+    """List tasks, newest first"""
+    return taskqueue.list_tasks(status, limit)
+
+@router.get("/tasks/stats")
+async def get_task_stats():
+    """Get task counts per status"""
+    return taskqueue.get_stats()
+
+@router.get("/tasks/{task_id}")
+async def get_task(task_id: int):
+    """Get a single task"""
+    task = taskqueue.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+@router.post("/tasks/{task_id}/retry")
+async def retry_task(task_id: int):
+    """Requeue a dead-lettered or cancelled task"""
+    if not taskqueue.requeue(task_id):
+        raise HTTPException(status_code=400, detail="Only dead or cancelled tasks can be retried")
+    return {"message": "Task requeued"}
+
+@router.delete("/tasks/{task_id}")
+async def cancel_task(task_id: int):
+    """Cancel a task that has not started yet"""
+    if not taskqueue.cancel(task_id):
+        raise HTTPException(status_code=400, detail="Only queued tasks can be cancelled")
+    return {"message": "Task cancelled"}
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+# 冷启动导入基准：在干净的子进程中导入 main，检查耗时和是否提前导入了重量级依赖
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RUNS = 5
+DEFAULT_BUDGET = 1.5  # seconds, median wall time for `import main`
+HEAVY_MODULES = ['droidrun', 'llama_index', 'tiktoken']
+
+PROBE = '''
+import sys, time, json
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+'''
+
+def measure_once(workdir: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    # 在临时目录中运行，避免 init_db 改动仓库中的 droidrun.db
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES)],
+        cwd=workdir, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the API server")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        samples = [measure_once(workdir) for _ in range(args.runs)]
+
+    times = [sample["seconds"] for sample in samples]
+    heavy = sorted({module for sample in samples for module in sample["heavy"]})
+    median = statistics.median(times)
+    print(f"import main: median {median * 1000:.1f} ms, min {min(times) * 1000:.1f} ms, max {max(times) * 1000:.1f} ms over {args.runs} runs")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported eagerly: {', '.join(heavy)}")
+        failed = True
+    if median > args.budget:
+        print(f"FAIL: median import time exceeds budget of {args.budget:.2f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
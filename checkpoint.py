@@ -0,0 +1,101 @@
+import asyncio
+import re
+import db
+import uitree
+
+# 购物流程的阶段，顺序与提示词中的 搜索→详情→加购→结算→支付 一致
+STAGES = [
+    ("search", "搜索"),
+    ("detail", "详情"),
+    ("cart", "加购"),
+    ("checkout", "结算"),
+    ("payment", "支付"),
+]
+# 提示词要求每个阶段完成后输出结构化标记，如"[验证:加购] 商品已加入购物车"
+STAGE_MARKER = re.compile(r'\[验证[:：](' + '|'.join(name for _, name in STAGES) + r')\]')
+MARKER_COUNT = 10  # 检查点记录的界面文本数量
+MARKER_MAX_LENGTH = 12
+MARKER_MATCH_RATIO = 0.5  # 恢复时至少要找到的界面文本比例
+
+def detect_stage(line: str) -> int | None:
+    """Index of the stage named by a "[验证:阶段]" marker, ignoring free-text mentions of other stages"""
+    match = STAGE_MARKER.search(line)
+    if match is None:
+        return None
+    return next(index for index, (_, name) in enumerate(STAGES) if name == match.group(1))
+
+def _ui_state(snapshot: uitree.UISnapshot) -> dict:
+    # 取界面上较短的文本作为特征，用于恢复时判断设备是否还在同一页面
+    return {
+        "package": snapshot.phone_state.get("packageName"),
+        "activity": snapshot.phone_state.get("activityName"),
+        "markers": snapshot.text_markers(MARKER_COUNT, MARKER_MAX_LENGTH),
+    }
+
+class StageTracker:
+    """Persists a checkpoint each time the agent reports a verified stage"""
+
+    def __init__(self, run_id: str, goal: str, device_id: str, start_index: int = -1):
+        self.run_id = run_id
+        self.goal = goal
+        self.device_id = device_id
+        self.last_index = start_index
+        self._pending = set()
+        # 日志可能来自droidrun的工作线程，保存任务统一调度到创建时的事件循环
+        self._loop = asyncio.get_running_loop()
+
+    def on_log(self, line: str):
+        index = detect_stage(line)
+        # 只接受紧接着的下一个阶段，跳跃的标记无法确认中间阶段已完成
+        if index is None or index != self.last_index + 1:
+            return
+        self.last_index = index
+        self._loop.call_soon_threadsafe(self._schedule, index)
+
+    def _schedule(self, index: int):
+        task = self._loop.create_task(self._save(index))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _save(self, index: int):
+        ui_state = None
+        if self.device_id:
+            try:
+                ui_state = _ui_state(await uitree.get_snapshot(self.device_id, max_age=0))
+            except uitree.UIError:
+                pass
+        db.add_run_checkpoint(self.run_id, self.goal, STAGES[index][0], index, self.device_id, ui_state)
+        print(f"[检查点] 已保存阶段：{STAGES[index][1]}")
+
+    async def flush(self):
+        # 让线程中排队的调度回调先执行
+        await asyncio.sleep(0)
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+def last_checkpoint(run_id: str) -> dict | None:
+    checkpoints = db.get_run_checkpoints(run_id)
+    return checkpoints[-1] if checkpoints else None
+
+async def verify_device_state(checkpoint: dict, device_id: str) -> bool:
+    """Check the device still shows the screen recorded with the checkpoint"""
+    ui_state = checkpoint.get("ui_state")
+    if not ui_state or checkpoint.get("device_id") != device_id:
+        return False
+    try:
+        snapshot = await uitree.get_snapshot(device_id, max_age=0)
+    except uitree.UIError:
+        return False
+    if ui_state.get("package") and snapshot.phone_state.get("packageName") != ui_state["package"]:
+        return False
+    return snapshot.matches_markers(ui_state.get("markers") or [], MARKER_MATCH_RATIO)
+
+def resume_goal(goal: str, checkpoint: dict) -> str:
+    """Rewrite the goal so the agent continues after the last verified stage"""
+    index = checkpoint["stage_index"]
+    done = "→".join(name for _, name in STAGES[:index + 1])
+    if index + 1 < len(STAGES):
+        remaining = f"从「{STAGES[index + 1][1]}」步骤继续"
+    else:
+        remaining = "只需确认最终状态"
+    return f"{goal}\n（已完成并验证：{done}。设备当前停留在该阶段的页面，{remaining}，不要返回首页重新开始）"
@@ -9,7 +9,18 @@ app_config = {
     "llmTemperature": 0.1,
     "enableVision": True,
     "enableReasoning": False,
-    "maxSteps": 20
+    "maxSteps": 20,
+    "taskWorkers": 1,
+    "taskBatchSize": 5,
+    "enableMacros": True,
+    "prewarmDroidrun": True,
+    "pipelinedObservation": False,
+    "healthMonitor": True,
+    "maxConcurrentRuns": 2,
+    "maxPendingRuns": 20,
+    "interactiveReservedRuns": 1,
+    "clientMaxInflight": 3,
+    "maxFanoutRuns": 8
 }
 
 # Configuration management functions
@@ -0,0 +1,131 @@
+import asyncio
+import uuid
+from collections import deque
+
+DEFAULT_TIMEOUT = 30  # seconds per command
+OUTPUT_BUFFER_LINES = 1000  # 每条命令最多缓冲的输出行数，消费端跟不上时暂停读取adb输出
+
+class ConsoleError(Exception):
+    pass
+
+class _PendingCommand:
+    def __init__(self, command: str):
+        self.command = command
+        self.output = asyncio.Queue(maxsize=OUTPUT_BUFFER_LINES)
+
+class ShellSession:
+    """A persistent `adb shell` process owned by one client; commands are pipelined and delimited by markers"""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.process = None
+        self.marker = f"__DROIDRUN_{uuid.uuid4().hex}__"
+        self._pending = deque()
+        self._reader = None
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                'adb', '-s', self.device_id, 'shell',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                limit=1024 * 1024
+            )
+        except FileNotFoundError:
+            raise ConsoleError("ADB not found. Please install Android SDK platform tools.")
+        self._reader = asyncio.create_task(self._read_loop())
+        print(f"Console session started for {self.device_id}")
+
+    async def _read_loop(self):
+        """Route output lines to the command at the head of the pipeline"""
+        try:
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break
+                text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if not self._pending:
+                    continue
+                pending = self._pending[0]
+                index = text.find(self.marker)
+                if index == -1:
+                    # put() 在队列满时阻塞，形成背压
+                    await pending.output.put(("line", text))
+                    continue
+                if index > 0:
+                    await pending.output.put(("line", text[:index]))
+                exit_code = text[index + len(self.marker) + 1:].strip()
+                self._pending.popleft()
+                await pending.output.put(("exit", int(exit_code) if exit_code.lstrip('-').isdigit() else None))
+        finally:
+            # 进程退出时通知所有未完成的命令
+            while self._pending:
+                pending = self._pending.popleft()
+                try:
+                    pending.output.put_nowait(("error", "Shell session closed"))
+                except asyncio.QueueFull:
+                    pass
+
+    async def submit(self, command: str) -> _PendingCommand:
+        """Write a command to the shell without waiting for earlier ones to finish"""
+        if not self.alive:
+            raise ConsoleError("Shell session is not running")
+        pending = _PendingCommand(command)
+        # 标准输入重定向到/dev/null，防止命令读取后续管道中的命令
+        script = f"{{ {command}\n}} </dev/null 2>&1\nprintf '%s:%s\\n' '{self.marker}' \"$?\"\n"
+        async with self._write_lock:
+            self._pending.append(pending)
+            self.process.stdin.write(script.encode('utf-8'))
+            await self.process.stdin.drain()
+        return pending
+
+    async def stream(self, pending: _PendingCommand, timeout: float = DEFAULT_TIMEOUT):
+        """Yield ("line", text) items and finally ("exit", code) for a submitted command"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                kind, value = await asyncio.wait_for(pending.output.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                # 无法单独中断管道中的命令，只能关闭会话；会话只属于当前客户端，不影响其他连接
+                await self.close()
+                yield ("timeout", f"Command timed out after {timeout}s")
+                return
+            yield (kind, value)
+            if kind != "line":
+                return
+
+    async def close(self):
+        if self.alive:
+            self.process.kill()
+            await self.process.wait()
+        if self._reader:
+            # 读取任务可能因消费端停止而阻塞在put()上
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        print(f"Console session closed for {self.device_id}")
+
+async def open_session(device_id: str) -> ShellSession:
+    """Start a private shell session; the caller closes it when its connection ends"""
+    session = ShellSession(device_id)
+    await session.start()
+    return session
+
+def strip_shell_prefix(command: str) -> str:
+    """Allow commands typed as 'adb shell ...' as well as plain shell commands"""
+    parts = command.strip().split(None, 2)
+    if len(parts) >= 2 and parts[0].lower() == "adb" and parts[1] == "shell":
+        return parts[2] if len(parts) == 3 else ""
+    if parts and parts[0] == "shell":
+        return command.strip()[len("shell"):].strip()
+    return command.strip()
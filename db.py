@@ -1,5 +1,6 @@
 import sqlite3
 import datetime
+import json
 from pydantic import BaseModel
 
 # Model for history response
@@ -23,6 +24,35 @@ def init_db():
             reason TEXT
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS macros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            goal_key TEXT NOT NULL,
+            goal TEXT NOT NULL,
+            app_package TEXT,
+            app_version TEXT,
+            steps TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used_at TEXT,
+            replay_count INTEGER NOT NULL DEFAULT 0,
+            fail_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_macros_goal_key ON macros (goal_key)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_checkpoints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            goal TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            stage_index INTEGER NOT NULL,
+            device_id TEXT,
+            ui_state TEXT,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_checkpoints_run_id ON run_checkpoints (run_id)")
     conn.commit()
     conn.close()
 
@@ -55,6 +85,33 @@ def get_history():
         for row in rows
     ]
 
+def iter_history(start: str = None, end: str = None, success: bool = None, chunk_size: int = 1000):
+    """Yield history rows as tuples in chunks from a server-side cursor, oldest first"""
+    conditions, params = [], []
+    if start:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < ?")
+        params.append(end)
+    if success is not None:
+        conditions.append("success = ?")
+        params.append(success)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    # 流式响应可能在不同线程中迭代生成器
+    conn = sqlite3.connect('droidrun.db', check_same_thread=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id, action, timestamp, success, reason FROM history{where} ORDER BY id", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
 def delete_history(id: int):
     conn = sqlite3.connect('droidrun.db')
     cursor = conn.cursor()
@@ -68,3 +125,112 @@ def delete_all_history():
     cursor.execute("DELETE FROM history")
     conn.commit()
     conn.close()
+
+# Macro operations
+def _row_to_macro(row):
+    return {
+        "id": row[0],
+        "goal_key": row[1],
+        "goal": row[2],
+        "app_package": row[3],
+        "app_version": row[4],
+        "steps": json.loads(row[5]),
+        "created_at": row[6],
+        "last_used_at": row[7],
+        "replay_count": row[8],
+        "fail_count": row[9]
+    }
+
+_MACRO_COLUMNS = "id, goal_key, goal, app_package, app_version, steps, created_at, last_used_at, replay_count, fail_count"
+
+def add_macro(goal_key: str, goal: str, app_package: str, app_version: str, steps: list):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    # 同一目标和应用版本只保留最新的宏
+    cursor.execute(
+        "DELETE FROM macros WHERE goal_key = ? AND app_package IS ? AND app_version IS ?",
+        (goal_key, app_package, app_version)
+    )
+    cursor.execute(
+        "INSERT INTO macros (goal_key, goal, app_package, app_version, steps, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (goal_key, goal, app_package, app_version, json.dumps(steps, ensure_ascii=False), datetime.datetime.now().isoformat())
+    )
+    macro_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return macro_id
+
+def find_macros(goal_key: str):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {_MACRO_COLUMNS} FROM macros WHERE goal_key = ? ORDER BY id DESC", (goal_key,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_macro(row) for row in rows]
+
+def get_macros():
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {_MACRO_COLUMNS} FROM macros ORDER BY id DESC")
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_macro(row) for row in rows]
+
+def record_macro_result(id: int, success: bool):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    column = "replay_count" if success else "fail_count"
+    cursor.execute(
+        f"UPDATE macros SET {column} = {column} + 1, last_used_at = ? WHERE id = ?",
+        (datetime.datetime.now().isoformat(), id)
+    )
+    conn.commit()
+    conn.close()
+
+def delete_macro(id: int):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM macros WHERE id = ?", (id,))
+    conn.commit()
+    conn.close()
+
+# Run checkpoint operations
+def _row_to_checkpoint(row):
+    return {
+        "id": row[0],
+        "run_id": row[1],
+        "goal": row[2],
+        "stage": row[3],
+        "stage_index": row[4],
+        "device_id": row[5],
+        "ui_state": json.loads(row[6]) if row[6] else None,
+        "timestamp": row[7]
+    }
+
+def add_run_checkpoint(run_id: str, goal: str, stage: str, stage_index: int, device_id: str, ui_state: dict):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO run_checkpoints (run_id, goal, stage, stage_index, device_id, ui_state, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (run_id, goal, stage, stage_index, device_id, json.dumps(ui_state, ensure_ascii=False), datetime.datetime.now().isoformat())
+    )
+    conn.commit()
+    conn.close()
+
+def get_run_checkpoints(run_id: str):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, run_id, goal, stage, stage_index, device_id, ui_state, timestamp FROM run_checkpoints WHERE run_id = ? ORDER BY stage_index, id",
+        (run_id,)
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_checkpoint(row) for row in rows]
+
+def delete_run_checkpoints(run_id: str):
+    conn = sqlite3.connect('droidrun.db')
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM run_checkpoints WHERE run_id = ?", (run_id,))
+    conn.commit()
+    conn.close()
@@ -1,4 +1,5 @@
 import subprocess
+import asyncio
 import time
 import datetime
 from fastapi import HTTPException
@@ -30,6 +31,45 @@ def run_adb_command(command):
         print(f"ADB command exception: {e}, command: {command}")
         return False, "", str(e)
 
+async def run_adb_command_async(command, timeout=10):
+    """Run ADB command without blocking the event loop and return result"""
+    full_command = ['adb'] + command
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *full_command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        print(f"ADB not found: {command}")
+        return False, "", "ADB not found. Please install Android SDK platform tools."
+    except Exception as e:
+        print(f"ADB command exception: {e}, command: {command}")
+        return False, "", str(e)
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        print(f"ADB command timeout: {command}")
+        return False, "", "ADB command timeout"
+
+    stdout = stdout.decode('utf-8', errors='replace').strip()
+    stderr = stderr.decode('utf-8', errors='replace').strip()
+    return process.returncode == 0, stdout, stderr
+
+async def get_package_version(device_id, package):
+    """Read an installed package's versionName with a single dumpsys call"""
+    success, stdout, _ = await run_adb_command_async(['-s', device_id, 'shell', 'dumpsys', 'package', package])
+    if not success:
+        return None
+    for line in stdout.splitlines():
+        line = line.strip()
+        if line.startswith('versionName='):
+            return line.split('=', 1)[1]
+    return None
+
 def get_connected_devices():
     """Get list of connected Android devices"""
     success, stdout, stderr = run_adb_command(['devices'])
@@ -260,6 +300,12 @@ def take_screenshot():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Screenshot failed: {str(e)}")
 
+DANGEROUS_COMMANDS = ['rm', 'rmdir', 'del', 'format', 'fdisk', 'mkfs']
+
+def is_dangerous_command(command: str) -> bool:
+    """Check a command against the blocked command list"""
+    return any(cmd in command.lower() for cmd in DANGEROUS_COMMANDS)
+
 def execute_adb_command_endpoint(command_data: dict):
     """Execute arbitrary ADB command"""
     try:
@@ -268,8 +314,7 @@ def execute_adb_command_endpoint(command_data: dict):
             raise HTTPException(status_code=400, detail="Command cannot be empty")
 
         # Security check - only allow safe commands
-        dangerous_commands = ['rm', 'rmdir', 'del', 'format', 'fdisk', 'mkfs']
-        if any(cmd in command.lower() for cmd in dangerous_commands):
+        if is_dangerous_command(command):
             raise HTTPException(status_code=400, detail="Dangerous command not allowed")
 
         # 处理用户输入的命令，移除可能的"adb"前缀
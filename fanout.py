@@ -0,0 +1,249 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+import action
+import db
+import health
+import log
+from config import app_config
+from device import get_connected_devices
+
+SELECTORS = ["healthy", "all", "wifi", "usb"]
+MAX_GROUPS = 50  # 内存中保留的分组数量，超出后丢弃最早完成的
+SUBSCRIBER_QUEUE_SIZE = 10000
+DEFAULT_MAX_RUNNING = 8  # 所有分组合计同时执行的设备数
+
+# Member states
+PENDING = "pending"
+RUNNING = "running"
+SUCCESS = "success"
+FAILED = "failed"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+NOT_STARTED = "not_started"  # 分组结束时仍在等待执行槽位
+
+class _Budget:
+    """Concurrency budget for fan-out members, separate from the single-run admission slots"""
+
+    def __init__(self):
+        self.running = 0
+        self._changed = asyncio.Condition()
+
+    # 配置每次读取，保存配置后立即生效
+    @property
+    def max_running(self) -> int:
+        return max(int(app_config.get("maxFanoutRuns", DEFAULT_MAX_RUNNING)), 1)
+
+    async def acquire(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.running < self.max_running)
+            self.running += 1
+
+    async def release(self):
+        self.running -= 1
+        async with self._changed:
+            self._changed.notify_all()
+
+_budget = _Budget()
+
+class _Member:
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.status = PENDING
+        self.reason = None
+        self.steps = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        duration = None
+        if self.started_at is not None:
+            duration = (self.finished_at or time.time()) - self.started_at
+        return {
+            "device": self.device_id,
+            "status": self.status,
+            "success": self.status == SUCCESS,
+            "reason": self.reason,
+            "steps": self.steps,
+            "duration_seconds": duration,
+        }
+
+class FanoutGroup:
+    """One goal executed on several devices in parallel"""
+
+    def __init__(self, goal: str, scenario: str, device_ids: list[str], quorum: int = None, timeout: float = None):
+        self.group_id = uuid.uuid4().hex
+        self.goal = goal
+        self.scenario = scenario
+        self.quorum = quorum
+        self.timeout = timeout  # 每台设备从开始执行起计时
+        self.members = {device_id: _Member(device_id) for device_id in device_ids}
+        self.status = RUNNING  # running / complete / quorum / cancelled
+        self.created_at = time.time()
+        self.finished_at = None
+        self.finished = asyncio.Event()
+        self._subscribers = []
+        self._task = None
+
+    # Events
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def _publish(self, event: dict):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # 订阅者太慢时丢弃日志，结果仍可通过 get_group 查询
+
+    # Execution
+    async def _execute(self, member: _Member) -> dict:
+        log_queue = asyncio.Queue()
+        done_event = asyncio.Event()
+        execution_task = asyncio.create_task(
+            action.stream_execute_droidrun_action(
+                self.goal, log_queue, done_event, self.scenario,
+                run_id=f"{self.group_id}-{member.device_id}", device_id=member.device_id
+            )
+        )
+        try:
+            async for line in log.log_generator(log_queue, done_event):
+                self._publish({"device": member.device_id, "log": line})
+            return await execution_task
+        finally:
+            if not execution_task.done():
+                execution_task.cancel()
+                await asyncio.gather(execution_task, return_exceptions=True)
+
+    async def _run_member(self, member: _Member):
+        # 分组成员使用独立的并发预算，不占用单次执行的槽位
+        await _budget.acquire()
+        try:
+            member.status = RUNNING
+            member.started_at = time.time()
+            try:
+                # 超时从设备开始执行时计算，排队等待的时间不计入
+                result = await asyncio.wait_for(self._execute(member), self.timeout)
+            except asyncio.TimeoutError:
+                member.finished_at = time.time()
+                member.status = TIMEOUT
+                member.reason = f"Timed out after {self.timeout}s"
+                self._publish({"member": member.to_dict()})
+                return
+        finally:
+            await _budget.release()
+        member.finished_at = time.time()
+        member.status = SUCCESS if result["success"] else FAILED
+        member.reason = result["reason"]
+        member.steps = result["steps"]
+        db.add_history(action=self.goal, success=result["success"], reason=f"[{member.device_id}] {result['reason']}")
+        self._publish({"member": member.to_dict()})
+
+    def _quorum_reached(self) -> bool:
+        succeeded = sum(1 for member in self.members.values() if member.status == SUCCESS)
+        return self.quorum is not None and succeeded >= self.quorum
+
+    async def _run(self):
+        tasks = {}
+        pending = set()
+        try:
+            tasks = {asyncio.create_task(self._run_member(member)): member for member in self.members.values()}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception():
+                        member = tasks[task]
+                        member.finished_at = time.time()
+                        member.status = FAILED
+                        member.reason = str(task.exception())
+                        self._publish({"member": member.to_dict()})
+                if not pending:
+                    self.status = "complete"
+                elif self._quorum_reached():
+                    self.status = "quorum"
+                    break
+        except asyncio.CancelledError:
+            self.status = CANCELLED
+        finally:
+            # 达到法定数量或取消后，停止仍在执行的设备；还没轮到执行的设备单独标记
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for member in self.members.values():
+                if member.status in (PENDING, RUNNING):
+                    member.status = NOT_STARTED if member.status == PENDING else CANCELLED
+                    member.finished_at = time.time()
+            self.finished_at = time.time()
+            self.finished.set()
+            self._publish({"group": self.to_dict()})
+            self._publish(None)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def cancel(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def to_dict(self) -> dict:
+        members = [member.to_dict() for member in self.members.values()]
+        counts = {}
+        for member in members:
+            counts[member["status"]] = counts.get(member["status"], 0) + 1
+        return {
+            "group_id": self.group_id,
+            "goal": self.goal,
+            "status": self.status,
+            "quorum": self.quorum,
+            "timeout": self.timeout,
+            "total": len(members),
+            "succeeded": counts.get(SUCCESS, 0),
+            "counts": counts,
+            "duration_seconds": (self.finished_at or time.time()) - self.created_at,
+            "members": members,
+        }
+
+_groups = OrderedDict()
+
+def select_devices(selector: str = "healthy", devices: list[str] = None) -> list[str]:
+    """Resolve explicit device ids or a selector against the connected devices"""
+    connected = get_connected_devices()
+    if devices:
+        missing = [device_id for device_id in devices if device_id not in connected]
+        if missing:
+            raise ValueError(f"Devices not connected: {', '.join(missing)}")
+        return list(dict.fromkeys(devices))
+    if selector == "all":
+        return connected
+    if selector == "healthy":
+        return [device_id for device_id in connected if health.is_available(device_id)]
+    if selector == "wifi":
+        return [device_id for device_id in connected if ':' in device_id]
+    if selector == "usb":
+        return [device_id for device_id in connected if ':' not in device_id]
+    raise ValueError(f"Unknown selector: {selector}, expected one of {', '.join(SELECTORS)}")
+
+def create_group(goal: str, scenario: str, device_ids: list[str], quorum: int = None, timeout: float = None) -> FanoutGroup:
+    group = FanoutGroup(goal, scenario, device_ids, quorum, timeout)
+    _groups[group.group_id] = group
+    # 只淘汰已经结束的分组
+    for group_id in list(_groups):
+        if len(_groups) <= MAX_GROUPS:
+            break
+        if _groups[group_id].finished.is_set():
+            del _groups[group_id]
+    return group
+
+def get_group(group_id: str) -> FanoutGroup | None:
+    return _groups.get(group_id)
+
+def list_groups() -> list[dict]:
+    return [group.to_dict() for group in reversed(_groups.values())]
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from collections import deque
+from device import run_adb_command_async
+
+HEALTH_INTERVAL = 30  # seconds between health sweeps
+HISTORY_SIZE = 120  # samples kept per device (~1 hour at the default interval)
+RECONNECT_BACKOFF_BASE = 5.0
+RECONNECT_BACKOFF_MAX = 300.0
+
+# 降级阈值，恢复时使用稍低的阈值避免状态来回抖动
+TEMPERATURE_DEGRADED = 42.0  # °C, battery temperature
+TEMPERATURE_RECOVERED = 39.0
+BATTERY_LOW = 15  # percent, only while not charging
+MEMORY_LOW_MB = 300
+THERMAL_STATUS_DEGRADED = 3  # PowerManager.THERMAL_STATUS_SEVERE
+
+_SEPARATOR = "__DROIDRUN_HEALTH__"
+# 一次 adb shell 调用同时采集电池、内存和温控状态
+_SAMPLE_SCRIPT = (
+    f"dumpsys battery; echo {_SEPARATOR}; "
+    f"grep -E 'MemTotal|MemAvailable' /proc/meminfo; echo {_SEPARATOR}; "
+    f"dumpsys thermalservice 2>/dev/null | grep -m 1 'Thermal Status'"
+)
+
+class DeviceHealth:
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.status = "unknown"  # healthy / degraded / offline / unknown
+        self.thermal_degraded = False  # 温度滞回单独记录，不受电量、离线等状态影响
+        self.reasons = []
+        self.last_sample = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.reconnect_attempts = 0
+        self.next_reconnect_at = 0.0
+
+    def to_dict(self, include_history: bool = False) -> dict:
+        data = {
+            "id": self.device_id,
+            "status": self.status,
+            "reasons": self.reasons,
+            "last_sample": self.last_sample,
+            "reconnect_attempts": self.reconnect_attempts,
+            "busy": is_busy(self.device_id),
+        }
+        if include_history:
+            data["history"] = list(self.history)
+        return data
+
+_devices = {}
+# 需要保持连接的WiFi设备（ip:port）
+_wifi_devices = set()
+
+def _get(device_id: str) -> DeviceHealth:
+    if device_id not in _devices:
+        _devices[device_id] = DeviceHealth(device_id)
+    return _devices[device_id]
+
+def track_wifi_device(address: str):
+    """Keep a WiFi device connected from now on"""
+    if ':' not in address:
+        address = f"{address}:5555"
+    _wifi_devices.add(address)
+
+def untrack_wifi_device(address: str = None):
+    if address is None:
+        _wifi_devices.clear()
+    else:
+        _wifi_devices.discard(address if ':' in address else f"{address}:5555")
+
+def _parse_sample(output: str) -> dict:
+    battery, memory, thermal = (output.split(_SEPARATOR) + ["", "", ""])[:3]
+    sample = {"timestamp": time.time()}
+
+    for line in battery.splitlines():
+        key, _, value = line.strip().partition(':')
+        value = value.strip()
+        if key == "level" and value.isdigit():
+            sample["battery_level"] = int(value)
+        elif key == "temperature" and value.lstrip('-').isdigit():
+            sample["temperature"] = int(value) / 10  # 单位为0.1°C
+        elif key in ("AC powered", "USB powered", "Wireless powered") and value == "true":
+            sample["charging"] = True
+    sample.setdefault("charging", False)
+
+    for line in memory.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            if parts[0] == "MemAvailable:":
+                sample["memory_available_mb"] = int(parts[1]) // 1024
+            elif parts[0] == "MemTotal:":
+                sample["memory_total_mb"] = int(parts[1]) // 1024
+
+    status = thermal.strip().rpartition(':')[2].strip()
+    if status.isdigit():
+        sample["thermal_status"] = int(status)
+    return sample
+
+def _evaluate(health: DeviceHealth, sample: dict):
+    reasons = []
+    temperature = sample.get("temperature")
+    if temperature is not None:
+        limit = TEMPERATURE_RECOVERED if health.thermal_degraded else TEMPERATURE_DEGRADED
+        health.thermal_degraded = temperature >= limit
+        if health.thermal_degraded:
+            reasons.append(f"temperature {temperature:.1f}°C")
+    if sample.get("thermal_status", 0) >= THERMAL_STATUS_DEGRADED:
+        reasons.append(f"thermal status {sample['thermal_status']}")
+    level = sample.get("battery_level")
+    if level is not None and level < BATTERY_LOW and not sample["charging"]:
+        reasons.append(f"battery {level}%")
+    memory = sample.get("memory_available_mb")
+    if memory is not None and memory < MEMORY_LOW_MB:
+        reasons.append(f"free memory {memory}MB")
+    health.reasons = reasons
+    health.status = "degraded" if reasons else "healthy"
+
+async def _adb_device_states() -> dict:
+    success, stdout, _ = await run_adb_command_async(['devices'])
+    states = {}
+    if success:
+        for line in stdout.splitlines()[1:]:
+            parts = line.split('\t')
+            if len(parts) >= 2:
+                states[parts[0]] = parts[1]
+    return states
+
+async def _reconnect(health: DeviceHealth):
+    now = time.time()
+    if now < health.next_reconnect_at:
+        return
+    health.reconnect_attempts += 1
+    delay = min(RECONNECT_BACKOFF_BASE * (2 ** (health.reconnect_attempts - 1)), RECONNECT_BACKOFF_MAX)
+    health.next_reconnect_at = now + delay
+    # 先断开残留的offline连接再重连
+    await run_adb_command_async(['disconnect', health.device_id])
+    success, stdout, _ = await run_adb_command_async(['connect', health.device_id])
+    connected = success and "connected" in stdout and "cannot" not in stdout
+    print(f"Reconnect {health.device_id} (attempt {health.reconnect_attempts}): {'ok' if connected else stdout}")
+
+async def _sample(health: DeviceHealth):
+    success, stdout, stderr = await run_adb_command_async(['-s', health.device_id, 'shell', _SAMPLE_SCRIPT], timeout=15)
+    if not success:
+        health.status = "offline"
+        health.reasons = [stderr or "health sample failed"]
+        return
+    sample = _parse_sample(stdout)
+    health.last_sample = sample
+    health.history.append(sample)
+    _evaluate(health, sample)
+
+async def check_once():
+    """One sweep: reconnect dropped WiFi devices and sample every connected device"""
+    states = await _adb_device_states()
+    # 自动纳入通过 adb connect 连接的设备
+    for device_id in states:
+        if ':' in device_id:
+            _wifi_devices.add(device_id)
+
+    jobs = []
+    for device_id in set(states) | _wifi_devices:
+        health = _get(device_id)
+        if states.get(device_id) == "device":
+            health.reconnect_attempts = 0
+            health.next_reconnect_at = 0.0
+            jobs.append(_sample(health))
+        else:
+            health.status = "offline"
+            health.reasons = [states.get(device_id, "disconnected")]
+            if device_id in _wifi_devices:
+                jobs.append(_reconnect(health))
+    await asyncio.gather(*jobs, return_exceptions=True)
+
+async def run_monitor(stop_event: asyncio.Event, interval: float = HEALTH_INTERVAL):
+    """Background loop that keeps running health sweeps until stop_event is set"""
+    print("Device health monitor started")
+    while not stop_event.is_set():
+        try:
+            await check_once()
+        except Exception as e:
+            print(f"Health check failed: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+    print("Device health monitor stopped")
+
+# Scheduler helpers
+# 正在执行任务的设备及其执行数，避免同一台设备被重复调度
+_busy = {}
+
+def mark_busy(device_id: str | None):
+    if device_id:
+        _busy[device_id] = _busy.get(device_id, 0) + 1
+
+def mark_idle(device_id: str | None):
+    if device_id in _busy:
+        _busy[device_id] -= 1
+        if not _busy[device_id]:
+            del _busy[device_id]
+
+def is_busy(device_id: str) -> bool:
+    return device_id in _busy
+
+def is_available(device_id: str) -> bool:
+    """Devices never sampled count as available; degraded, offline and busy ones do not"""
+    if is_busy(device_id):
+        return False
+    health = _devices.get(device_id)
+    return health is None or health.status in ("healthy", "unknown")
+
+def pick_device(device_ids: list[str]) -> str | None:
+    """First healthy, idle device; None when every device is busy or degraded"""
+    for device_id in device_ids:
+        if is_available(device_id):
+            return device_id
+    return None
+
+def get_health(device_id: str = None, include_history: bool = False):
+    if device_id is not None:
+        health = _devices.get(device_id)
+        return health.to_dict(include_history) if health else None
+    return [health.to_dict(include_history) for health in _devices.values()]
@@ -1,14 +1,28 @@
 import sys
 import asyncio
+import contextvars
 import json
 import re
 from io import StringIO
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# SSE批量发送设置
+SSE_BATCH_MAX_LINES = 100  # 单个事件最多包含的日志行数
+SSE_BATCH_MAX_BYTES = 16 * 1024  # 单个事件的最大字节数
+SSE_BATCH_MAX_DELAY = 0.1  # 第一行进入批次后最多等待的秒数
+SSE_HEARTBEAT_INTERVAL = 15.0  # 空闲时发送心跳的间隔，防止代理断开连接
+
 # 自定义流类，用于捕获日志并将其发送到队列
 class AsyncLogStream:
-    def __init__(self, queue: asyncio.Queue):
+    def __init__(self, queue: asyncio.Queue, on_line=None):
         self.queue = queue
         self.buffer = []
+        # 可选回调，在显示过滤之前收到每条刷新的日志
+        self.on_line = on_line
 
     def write(self, message):
         """将消息写入缓冲区，当内容足够时刷新"""
@@ -32,9 +46,12 @@ class AsyncLogStream:
         
         if should_flush:
             content_to_flush = buffer_content.strip()
+            if content_to_flush and self.on_line:
+                self.on_line(content_to_flush)
             if content_to_flush and self._should_include_message(content_to_flush):
                 # 使用异步队列的put_nowait方法，避免在同步方法中使用await
-                self.queue.put_nowait(content_to_flush)
+                # 每条消息单独成行，log_generator按换行切分，不会与下一条拼接
+                self.queue.put_nowait(content_to_flush + '\n')
             self.buffer = []
 
     def _should_include_message(self, message: str) -> bool:
@@ -95,13 +112,50 @@ class AsyncLogStream:
         """将缓冲区刷新到队列"""
         if self.buffer:
             line = ''.join(self.buffer)
-            self.queue.put_nowait(line)
+            self.queue.put_nowait(line if line.endswith('\n') else line + '\n')
             self.buffer = []
 
     def close(self):
         """关闭流"""
         self.flush()
 
+# 按执行上下文路由stdout/stderr，多个并发执行的日志不会串到彼此的队列
+_capture_streams = contextvars.ContextVar("capture_streams", default=None)
+
+class _StreamRouter:
+    """Stand-in for sys.stdout/sys.stderr that writes to the current run's stream"""
+
+    def __init__(self, index: int, fallback):
+        self.index = index
+        self.fallback = fallback
+
+    def _target(self):
+        streams = _capture_streams.get()
+        return streams[self.index] if streams else self.fallback
+
+    def write(self, message):
+        return self._target().write(message)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+def _install_routers():
+    if not isinstance(sys.stdout, _StreamRouter):
+        sys.stdout = _StreamRouter(0, sys.stdout)
+    if not isinstance(sys.stderr, _StreamRouter):
+        sys.stderr = _StreamRouter(1, sys.stderr)
+
+def start_capture(stdout_stream, stderr_stream) -> contextvars.Token:
+    """Send prints from the current task (and tasks/threads it starts) to the given streams"""
+    _install_routers()
+    return _capture_streams.set((stdout_stream, stderr_stream))
+
+def stop_capture(token: contextvars.Token):
+    _capture_streams.reset(token)
+
 # Async generator to read logs from queue and yield them
 async def log_generator(queue: asyncio.Queue, done_event: asyncio.Event):
     """异步生成器，用于从队列中生成日志消息"""
@@ -153,3 +207,61 @@ def _clean_log_line(log_line: str) -> str:
     log_line = log_line.strip()
     
     return log_line
+
+
+def dumps(data) -> str:
+    """Serialize an SSE payload, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+async def sse_log_batches(lines,
+                          max_lines: int = SSE_BATCH_MAX_LINES,
+                          max_bytes: int = SSE_BATCH_MAX_BYTES,
+                          max_delay: float = SSE_BATCH_MAX_DELAY,
+                          heartbeat: float = SSE_HEARTBEAT_INTERVAL):
+    """Coalesce log lines into size/time-bounded SSE events, with heartbeats while idle"""
+    pending = asyncio.Queue()
+    finished = object()
+
+    async def pump():
+        try:
+            async for line in lines:
+                await pending.put(line)
+        finally:
+            await pending.put(finished)
+
+    pump_task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    try:
+        done = False
+        while not done:
+            # 等待批次的第一行，空闲太久则发送心跳注释
+            try:
+                line = await asyncio.wait_for(pending.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if line is finished:
+                break
+
+            batch = [line]
+            size = len(line.encode("utf-8"))
+            deadline = loop.time() + max_delay
+            while len(batch) < max_lines and size < max_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    line = await asyncio.wait_for(pending.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if line is finished:
+                    done = True
+                    break
+                batch.append(line)
+                size += len(line.encode("utf-8"))
+
+            yield f"data: {dumps({'logs': batch})}\n\n"
+    finally:
+        pump_task.cancel()
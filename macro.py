@@ -0,0 +1,227 @@
+import asyncio
+import base64
+import functools
+import inspect
+import shlex
+import db
+import uitree
+from device import get_package_version, run_adb_command_async
+
+# Agent tool methods that change the device and are recorded for replay
+RECORDED_ACTIONS = ['start_app', 'tap_by_index', 'tap', 'tap_by_coordinates', 'swipe', 'input_text', 'press_key', 'back']
+# 按屏幕坐标操作的步骤，换一台分辨率不同的设备就会点错位置，这类执行不编译成宏
+COORDINATE_ACTIONS = ['tap', 'tap_by_coordinates', 'swipe']
+# Attributes under which DroidAgent may expose its tools object
+TOOL_ATTRIBUTES = ['tools_instance', 'tools']
+
+SETTLE_SECONDS = 1.0  # 每步操作后等待界面稳定
+CHECKPOINT_TIMEOUT = 8.0  # 回放时等待检查点满足的最长时间
+CHECKPOINT_POLL = 0.5
+
+def goal_key(goal: str) -> str:
+    """Normalize a goal so trivially different spellings share a macro"""
+    return " ".join(goal.split()).lower()
+
+def _describe(element: dict) -> dict:
+    return {
+        "text": element["text"],
+        "resource_id": element["resource_id"],
+        "class_name": element["class_name"],
+        "bounds": element["bounds"],
+    }
+
+class MacroRecorder:
+    """Wraps agent tool methods to capture the action sequence plus UI checkpoints"""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.steps = []
+        self.app_package = None
+        self.replayable = True
+
+    async def _checkpoint(self, name: str, args: dict) -> dict | None:
+        try:
+            snapshot = await uitree.get_snapshot(self.device_id, max_age=0)
+        except uitree.UIError:
+            return None
+        checkpoint = {"package": snapshot.phone_state.get("packageName")}
+        if name == 'verify':
+            # 最终界面的文本特征，回放结束时必须匹配才算成功
+            checkpoint["markers"] = snapshot.text_markers()
+        if name == 'tap_by_index':
+            index = args.get("index")
+            target = next((e for e in snapshot.elements if e["index"] == index), None)
+            if target is None or target["bounds"] is None:
+                return None
+            checkpoint["target"] = _describe(target)
+        return checkpoint
+
+    def _record(self, name: str, args: dict, checkpoint: dict | None):
+        if name == 'start_app' and not self.app_package:
+            self.app_package = args.get("package")
+        elif checkpoint and checkpoint.get("package") and not self.app_package:
+            self.app_package = checkpoint["package"]
+        if name == 'tap_by_index' and not (checkpoint and checkpoint.get("target")):
+            # 无法定位点击目标，这次执行不能编译成宏
+            self.replayable = False
+        if name in COORDINATE_ACTIONS:
+            self.replayable = False
+        self.steps.append({"action": name, "args": args, "checkpoint": checkpoint})
+
+    def wrap(self, name: str, method):
+        signature = inspect.signature(method)
+
+        def bind(*args, **kwargs) -> dict:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return dict(bound.arguments)
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                arguments = bind(*args, **kwargs)
+                checkpoint = await self._checkpoint(name, arguments)
+                result = await method(*args, **kwargs)
+                self._record(name, arguments, checkpoint)
+                return result
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            arguments = bind(*args, **kwargs)
+            result = method(*args, **kwargs)
+            self._record(name, arguments, None)
+            return result
+        return wrapper
+
+def attach_recorder(agent, device_id: str) -> MacroRecorder | None:
+    """Install a recorder on the agent's tools; returns None if the agent exposes no tools"""
+    tools = next((getattr(agent, name) for name in TOOL_ATTRIBUTES if getattr(agent, name, None) is not None), None)
+    if tools is None:
+        return None
+    recorder = MacroRecorder(device_id)
+    for name in RECORDED_ACTIONS:
+        method = getattr(tools, name, None)
+        if callable(method):
+            setattr(tools, name, recorder.wrap(name, method))
+    return recorder
+
+async def save_macro(goal: str, recorder: MacroRecorder) -> int | None:
+    """Compile a successful run into a macro"""
+    if not recorder or not recorder.steps or not recorder.replayable:
+        return None
+    # 记录结束时的界面作为最终检查点，没有可验证的结束界面就不保存
+    final = await recorder._checkpoint('verify', {})
+    if not final or not final["markers"]:
+        return None
+    steps = recorder.steps + [{"action": "verify", "args": {}, "checkpoint": final}]
+    app_version = None
+    if recorder.app_package:
+        app_version = await get_package_version(recorder.device_id, recorder.app_package)
+    return db.add_macro(goal_key(goal), goal, recorder.app_package, app_version, steps)
+
+# Replay
+async def _adb_shell(device_id: str, *args) -> bool:
+    success, _, stderr = await run_adb_command_async(['-s', device_id, 'shell', *args])
+    if not success:
+        print(f"[回放] 命令失败: {stderr}")
+    return success
+
+def _center(bounds) -> tuple:
+    return (bounds[0] + bounds[2]) // 2, (bounds[1] + bounds[3]) // 2
+
+async def _wait_for_checkpoint(device_id: str, checkpoint: dict) -> tuple[bool, dict | None]:
+    """Poll the UI until the recorded checkpoint holds; returns the matched target element"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHECKPOINT_TIMEOUT
+    target = checkpoint.get("target")
+    while True:
+        try:
+            snapshot = await uitree.get_snapshot(device_id, max_age=0)
+            package_ok = not checkpoint.get("package") or snapshot.phone_state.get("packageName") == checkpoint["package"]
+            match = None
+            if target:
+                candidates = snapshot.find(text=target["text"] or None, resource_id=target["resource_id"] or None)
+                candidates = [e for e in candidates if e["class_name"] == target["class_name"] and e["bounds"]]
+                if not target["text"] and not target["resource_id"]:
+                    # 无文本和ID的元素只能按位置匹配
+                    candidates = [e for e in snapshot.at(*_center(target["bounds"])) if e["class_name"] == target["class_name"]]
+                match = candidates[0] if candidates else None
+            markers_ok = snapshot.matches_markers(checkpoint.get("markers") or [])
+            if package_ok and markers_ok and (not target or match):
+                return True, match
+        except uitree.UIError:
+            pass
+        if loop.time() >= deadline:
+            return False, None
+        await asyncio.sleep(CHECKPOINT_POLL)
+
+async def _execute_step(device_id: str, step: dict, target: dict | None) -> bool:
+    name, args = step["action"], step["args"]
+    if name == 'verify':
+        return True
+    if name == 'start_app':
+        activity = args.get("activity")
+        if activity:
+            return await _adb_shell(device_id, 'am', 'start', '-n', f"{args['package']}/{activity}")
+        return await _adb_shell(device_id, 'monkey', '-p', args['package'], '-c', 'android.intent.category.LAUNCHER', '1')
+    if name == 'tap_by_index':
+        x, y = _center(target["bounds"])
+        return await _adb_shell(device_id, 'input', 'tap', str(x), str(y))
+    if name == 'input_text':
+        # 通过Portal键盘输入，支持中文
+        encoded = base64.b64encode(args['text'].encode('utf-8')).decode('ascii')
+        return await _adb_shell(
+            device_id, 'content', 'insert', '--uri', 'content://com.droidrun.portal/keyboard/input',
+            '--bind', shlex.quote(f"base64_text:s:{encoded}")
+        )
+    if name == 'press_key':
+        return await _adb_shell(device_id, 'input', 'keyevent', str(args['keycode']))
+    if name == 'back':
+        return await _adb_shell(device_id, 'input', 'keyevent', '4')
+    print(f"[回放] 不支持的操作: {name}")
+    return False
+
+def _is_replayable(steps: list) -> bool:
+    # 旧的宏只记录了应用包名，无法确认最终状态；含坐标操作的宏与屏幕尺寸绑定，都不再回放
+    if any(step["action"] in COORDINATE_ACTIONS for step in steps):
+        return False
+    final = steps[-1] if steps else {}
+    return final.get("action") == 'verify' and bool((final.get("checkpoint") or {}).get("markers"))
+
+async def replay(goal: str, device_id: str) -> dict | None:
+    """Replay a stored macro for the goal; returns None when there is none or a checkpoint fails"""
+    for macro in db.find_macros(goal_key(goal)):
+        if not _is_replayable(macro["steps"]):
+            continue
+        if macro["app_package"]:
+            version = await get_package_version(device_id, macro["app_package"])
+            if version != macro["app_version"]:
+                continue
+        break
+    else:
+        return None
+
+    print(f"[回放] 使用已录制的宏 #{macro['id']}，共{len(macro['steps'])}步")
+    for number, step in enumerate(macro["steps"], start=1):
+        checkpoint = step.get("checkpoint") or {}
+        if step["action"] == 'start_app':
+            # 启动应用前的界面不固定，不做检查
+            checkpoint = {}
+        ok, target = await _wait_for_checkpoint(device_id, checkpoint)
+        if not ok or not await _execute_step(device_id, step, target):
+            db.record_macro_result(macro["id"], False)
+            print(f"[回放] 第{number}步检查失败，切换到智能体执行")
+            uitree.invalidate(device_id)
+            return None
+        uitree.invalidate(device_id)
+        await asyncio.sleep(SETTLE_SECONDS)
+
+    db.record_macro_result(macro["id"], True)
+    print(f"[完成] 宏 #{macro['id']} 回放成功")
+    return {
+        "success": True,
+        "reason": f"Replayed macro #{macro['id']}",
+        "steps": len(macro["steps"]),
+        "macro_id": macro["id"],
+    }
@@ -7,8 +7,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import modularized components
+import asyncio
+import action
 import db
-from api import core, history, device, config
+import health
+import taskqueue
+import worker
+from config import app_config
+from api import core, history, device, config, tasks, fanout
 
 # Initialize FastAPI app
 app = FastAPI(title="DroidRun API", version="1.0")
@@ -20,16 +26,51 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Retry-After"],  # 跨域的前端需要读取429响应的重试时间
 )
 
 # Initialize database on startup
 db.init_db()
+taskqueue.init_queue()
 
 # Include all API routers
 app.include_router(core.router)
 app.include_router(history.router)
 app.include_router(device.router)
 app.include_router(config.router)
+app.include_router(tasks.router)
+app.include_router(fanout.router)
+
+# Background workers for the persistent task queue
+worker_stop_event = asyncio.Event()
+background_tasks = []
+
+@app.on_event("startup")
+async def start_task_workers():
+    for _ in range(app_config.get("taskWorkers", 1)):
+        background_tasks.append(asyncio.create_task(
+            worker.run_worker(batch_size=app_config.get("taskBatchSize", 5), stop_event=worker_stop_event)
+        ))
+
+@app.on_event("startup")
+async def start_health_monitor():
+    if app_config.get("healthMonitor", True):
+        background_tasks.append(asyncio.create_task(health.run_monitor(worker_stop_event)))
+
+# 服务开始监听后再在后台预热droidrun
+PREWARM_DELAY = 1.0
+
+@app.on_event("startup")
+async def start_prewarm():
+    if app_config.get("prewarmDroidrun", True):
+        background_tasks.append(asyncio.create_task(action.prewarm(PREWARM_DELAY)))
+
+@app.on_event("shutdown")
+async def stop_task_workers():
+    worker_stop_event.set()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
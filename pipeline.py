@@ -0,0 +1,223 @@
+import asyncio
+import functools
+import inspect
+import time
+import uitree
+from macro import RECORDED_ACTIONS, TOOL_ATTRIBUTES
+
+# Agent tool methods that capture the observation for the next LLM call
+OBSERVATION_METHODS = ['get_state', 'take_screenshot']
+
+PIPELINED_ACTION_WAIT = 0.2  # 流水线模式下智能体自身的固定等待，界面稳定由预取判断
+SETTLE_POLL = 0.3  # 连续两次界面摘要相同即视为稳定
+
+def _summarize(samples: list) -> dict:
+    if not samples:
+        return {"count": 0, "avg": None, "p50": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "avg": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "max": ordered[-1],
+    }
+
+class _Prefetch:
+    def __init__(self, generation: int, task: asyncio.Task):
+        self.generation = generation
+        self.task = task
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.results = {}
+        self.digest = None  # 采集时的界面摘要，提供结果前用来确认界面没有变化
+        self.verified = False
+        self.measured = False
+
+class ObservationPipeline:
+    """Starts the next observation right after each action so capture overlaps agent/LLM work"""
+
+    def __init__(self, tools, device_id: str, settle_timeout: float):
+        self.tools = tools
+        self.device_id = device_id
+        self.settle_timeout = settle_timeout
+        self._observers = {}  # name -> original observation method
+        self._generation = 0
+        self._prefetch = None
+        self._last_action_at = None
+        self._step_latencies = []
+        self._overlaps = []
+        self._waits = []
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def install(self) -> bool:
+        """Wrap the tools; returns False when there is no async observation method to prefetch"""
+        for name in OBSERVATION_METHODS:
+            method = getattr(self.tools, name, None)
+            # 同步的观察方法只能放到线程里预取，取消后线程仍会改写工具的元素缓存，因此不做预取
+            if inspect.iscoroutinefunction(method):
+                self._observers[name] = method
+                setattr(self.tools, name, self._wrap_observation(name, method))
+        if not self._observers:
+            return False
+        for name in RECORDED_ACTIONS:
+            method = getattr(self.tools, name, None)
+            if callable(method):
+                setattr(self.tools, name, self._wrap_action(method))
+        return True
+
+    # Actions
+    def _before_action(self):
+        now = time.perf_counter()
+        if self._last_action_at is not None:
+            self._step_latencies.append(now - self._last_action_at)
+        self._last_action_at = now
+        # 新的操作会改变界面，尚未使用的预取作废
+        self._discard()
+        self._generation += 1
+
+    def _after_action(self):
+        if self.device_id:
+            uitree.invalidate(self.device_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        generation = self._generation
+        self._prefetch = _Prefetch(generation, loop.create_task(self._capture(generation)))
+
+    def _wrap_action(self, method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                self._before_action()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    self._after_action()
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            self._before_action()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._after_action()
+        return wrapper
+
+    # Prefetch
+    async def _digest(self) -> str | None:
+        try:
+            return (await uitree.get_snapshot(self.device_id, max_age=0)).digest
+        except uitree.UIError:
+            return None
+
+    async def _wait_settled(self) -> str | None:
+        """Wait until two consecutive UI digests match; returns the settled digest"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.settle_timeout
+        previous = None
+        while loop.time() < deadline:
+            digest = await self._digest()
+            if digest is None:
+                # 拿不到界面树时退回固定等待
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+                return None
+            if digest == previous:
+                return digest
+            previous = digest
+            await asyncio.sleep(SETTLE_POLL)
+        return None
+
+    async def _capture(self, generation: int):
+        # 没有界面摘要就无法判断预取是否过期，不做预取
+        if not self.device_id:
+            return
+        digest = await self._wait_settled()
+        prefetch = self._prefetch
+        if digest is None or prefetch is None or prefetch.generation != generation:
+            return
+        results = {}
+        for name, method in self._observers.items():
+            if generation != self._generation:
+                return
+            results[name] = await method()
+        # 采集期间界面又发生了变化，结果不可用
+        if generation != self._generation or await self._digest() != digest:
+            return
+        prefetch.digest = digest
+        prefetch.results = results
+        prefetch.finished_at = time.perf_counter()
+
+    async def _still_current(self, prefetch: _Prefetch) -> bool:
+        """Re-read the cheap UI digest before serving a prefetch; late loads or toasts make it stale"""
+        if not prefetch.verified:
+            prefetch.verified = await self._digest() == prefetch.digest
+            if not prefetch.verified and prefetch is self._prefetch:
+                self._discard()
+        return prefetch.verified
+
+    def _discard(self):
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is None:
+            return
+        if prefetch.results or not prefetch.task.done():
+            self.stale += 1
+        prefetch.task.cancel()
+
+    def _take(self, name: str, requested_at: float, waited: float):
+        """Consume a prefetched observation; each result is served once"""
+        prefetch = self._prefetch
+        if prefetch is None or prefetch.generation != self._generation or name not in prefetch.results:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        if not prefetch.measured:
+            # 预取开始到智能体请求观察之间的时间都与其他工作重叠
+            finished_at = prefetch.finished_at or requested_at
+            self._overlaps.append(max(min(finished_at, requested_at) - prefetch.started_at, 0))
+            prefetch.measured = True
+        self._waits.append(waited)
+        return True, prefetch.results.pop(name)
+
+    # Observations
+    def _wrap_observation(self, name: str, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            requested_at = time.perf_counter()
+            prefetch = self._prefetch
+            if not args and not kwargs and prefetch and prefetch.generation == self._generation:
+                # 只等待预取完成，不传播它的取消或异常
+                await asyncio.wait([prefetch.task])
+                if name in prefetch.results and await self._still_current(prefetch):
+                    hit, result = self._take(name, requested_at, time.perf_counter() - requested_at)
+                    if hit:
+                        return result
+                else:
+                    self.misses += 1
+            else:
+                self.misses += 1
+            return await method(*args, **kwargs)
+        return wrapper
+
+    def close(self):
+        self._discard()
+
+    def metrics(self) -> dict:
+        return {
+            "steps": len(self._step_latencies) + (1 if self._last_action_at is not None else 0),
+            "step_latency_seconds": _summarize(self._step_latencies),
+            "prefetch": {"hits": self.hits, "misses": self.misses, "stale": self.stale},
+            "overlap_seconds": sum(self._overlaps),
+            "observation_wait_seconds": _summarize(self._waits),
+        }
+
+def attach_pipeline(agent, device_id: str, settle_timeout: float) -> ObservationPipeline | None:
+    """Install speculative observation prefetch on the agent's tools; None if there is nothing to prefetch"""
+    tools = next((getattr(agent, name) for name in TOOL_ATTRIBUTES if getattr(agent, name, None) is not None), None)
+    if tools is None:
+        return None
+    pipeline = ObservationPipeline(tools, device_id, settle_timeout)
+    return pipeline if pipeline.install() else None
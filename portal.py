@@ -1,24 +1,129 @@
 import os
+import asyncio
+import hashlib
 import urllib.request
 from fastapi import HTTPException
-from device import get_connected_devices, run_adb_command
+from device import get_connected_devices, get_package_version, run_adb_command, run_adb_command_async
+
+PORTAL_PACKAGE = "com.droidrun.portal"
+PORTAL_VERSION = "0.4.7"
+PORTAL_URL = f"https://github.com/droidrun/droidrun-portal/releases/download/v{PORTAL_VERSION}/droidrun-portal-v{PORTAL_VERSION}.apk"
+PORTAL_PATH = "droidrun-portal.apk"
+# 各发布版本APK的SHA-256，升级PORTAL_VERSION时必须同时补上对应版本的校验和
+PORTAL_RELEASE_SHA256 = {
+    # "0.4.7": "<sha256 of droidrun-portal-v0.4.7.apk>",
+}
+# 环境变量只用于覆盖固定的校验和（如使用自建镜像）
+PORTAL_SHA256 = os.getenv("PORTAL_APK_SHA256") or PORTAL_RELEASE_SHA256.get(PORTAL_VERSION)
+
+FLEET_INSTALL_CONCURRENCY = 4
+INSTALL_TIMEOUT = 180  # seconds per device
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _verify_apk(path: str) -> bool:
+    """Check the cached APK against the pinned checksum"""
+    if not PORTAL_SHA256:
+        return False
+    return _sha256(path) == PORTAL_SHA256.lower()
+
+def _download(url: str, path: str):
+    """Download to a temporary file and only move it into place once verified"""
+    # 没有可信的校验和时不下载，下载文件自身算出的校验和不能证明它未被篡改
+    if not PORTAL_SHA256:
+        raise ValueError(f"No pinned SHA-256 for Portal v{PORTAL_VERSION}, set PORTAL_APK_SHA256 or install from a local APK")
+    tmp_path = path + ".part"
+    urllib.request.urlretrieve(url, tmp_path)
+    checksum = _sha256(tmp_path)
+    if checksum != PORTAL_SHA256.lower():
+        os.remove(tmp_path)
+        raise ValueError(f"Checksum mismatch: expected {PORTAL_SHA256}, got {checksum}")
+    os.replace(tmp_path, path)
 
 async def download_portal_apk():
     """Download DroidRun Portal APK file"""
-    portal_url = "https://github.com/droidrun/droidrun-portal/releases/download/v0.4.7/droidrun-portal-v0.4.7.apk"
-    portal_path = "droidrun-portal.apk"
-    # Check if file already exists
-    if os.path.exists(portal_path):
-        return portal_path
+    # Reuse the cached file if its checksum still matches
+    if os.path.exists(PORTAL_PATH) and _verify_apk(PORTAL_PATH):
+        return PORTAL_PATH
     try:
-        print(f"Downloading DroidRun Portal APK from {portal_url}")
-        urllib.request.urlretrieve(portal_url, portal_path)
+        print(f"Downloading DroidRun Portal APK from {PORTAL_URL}")
+        await asyncio.to_thread(_download, PORTAL_URL, PORTAL_PATH)
         print("Download completed")
-        return portal_path
+        return PORTAL_PATH
     except Exception as e:
         print(f"Download failed: {e}")
-        # Try alternative download location
-         
+        raise HTTPException(status_code=502, detail=f"Portal APK download failed: {e}")
+
+def _parse_version(version: str) -> tuple:
+    parts = []
+    for part in version.split('.'):
+        digits = ''.join(c for c in part if c.isdigit())
+        parts.append(int(digits) if digits else 0)
+    return tuple(parts)
+
+async def get_installed_portal_version(device_id: str) -> str | None:
+    """Read the installed Portal versionName"""
+    return await get_package_version(device_id, PORTAL_PACKAGE)
+
+async def install_portal_fleet(device_ids: list[str] = None, portal_path: str = None, force: bool = False, concurrency: int = FLEET_INSTALL_CONCURRENCY):
+    """Install Portal on many devices in parallel, yielding per-device progress events"""
+    device_ids = device_ids or get_connected_devices()
+    if not device_ids:
+        yield {"event": "error", "detail": "No device connected"}
+        return
+
+    try:
+        if not portal_path:
+            portal_path = await download_portal_apk()
+        elif not os.path.exists(portal_path):
+            raise HTTPException(status_code=400, detail="Portal APK file not found")
+    except HTTPException as e:
+        yield {"event": "error", "detail": e.detail}
+        return
+
+    progress = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def install_one(device_id: str):
+        installed = await get_installed_portal_version(device_id)
+        if installed and not force and _parse_version(installed) >= _parse_version(PORTAL_VERSION):
+            await progress.put({"event": "skipped", "device": device_id, "version": installed})
+            return "skipped"
+
+        async with semaphore:
+            await progress.put({"event": "installing", "device": device_id, "from_version": installed})
+            success, stdout, stderr = await run_adb_command_async(
+                ['-s', device_id, 'install', '-r', portal_path], timeout=INSTALL_TIMEOUT
+            )
+        if success:
+            await progress.put({"event": "installed", "device": device_id, "version": PORTAL_VERSION})
+            return "installed"
+        await progress.put({"event": "failed", "device": device_id, "detail": stderr or stdout})
+        return "failed"
+
+    yield {"event": "start", "devices": device_ids, "version": PORTAL_VERSION}
+    jobs = [asyncio.create_task(install_one(device_id)) for device_id in device_ids]
+    gather = asyncio.gather(*jobs, return_exceptions=True)
+
+    # 边执行边输出各设备进度
+    while not gather.done() or not progress.empty():
+        try:
+            yield await asyncio.wait_for(progress.get(), timeout=0.5)
+        except asyncio.TimeoutError:
+            continue
+
+    outcomes = [r if isinstance(r, str) else "failed" for r in gather.result()]
+    yield {
+        "event": "done",
+        "installed": outcomes.count("installed"),
+        "skipped": outcomes.count("skipped"),
+        "failed": outcomes.count("failed"),
+    }
 
 async def install_portal(portal_path: str = None):
     """Install DroidRun Portal app on device"""
@@ -0,0 +1,291 @@
+import re
+import threading
+
+# 完整的电商购物提示词，未匹配到更具体场景时使用
+FULL_MANAGER_PROMPT = """你是专业的电商购物助手，需要精准响应并执行用户的购物相关操作指令。保持回答简洁，专注于任务执行（如遇到支付步骤请暂停，提示用户进行支付）。
+
+日志输出规范：
+- 只输出关键操作步骤和重要状态信息
+- 详细记录购物流程的每个关键节点：搜索→详情→加购→结算→支付
+- 报告重要的验证结果和状态确认
+- 避免输出技术细节、调试信息和内部状态
+- 使用简洁明了的中文描述用户关心的操作进展
+- 格式："[操作类型] 具体操作描述"，如"[点击] 点击搜索按钮"，"[验证:加购] 商品已添加到购物车"
+- 每个阶段确认完成后输出一次"[验证:阶段] 描述"，阶段只能是 搜索/详情/加购/结算/支付，且必须是刚刚完成的那个阶段
+
+界面定位原则：
+1. 优先使用文本匹配：通过按钮文本、标题、标签等文本内容定位元素
+2. 其次使用位置关系：基于屏幕坐标、相对位置进行定位
+3. 使用视觉特征：通过颜色、形状、图标等视觉特征识别元素
+4. 元素预查验证：在操作前检查元素是否存在、可访问、可操作
+5. 验证元素状态：确保按钮可点击、输入框可编辑、界面已完全加载
+
+操作执行策略：
+1. 操作前截图验证：确保当前界面符合预期状态
+2. 分步精确执行：每个操作后等待界面响应完成
+3. 智能重试机制：操作失败时重试，最多3次，每次调整策略
+   - 第1次重试：等待更长时间后重试
+   - 第2次重试：尝试备选定位方式（如坐标定位改为文本定位）
+   - 第3次重试：重新加载页面或应用后重试
+4. 错误处理：遇到异常立即停止并报告具体错误信息
+
+遵循以下流程：
+1. 快速理解用户需求（搜索商品、浏览分类、查看详情、加入购物车、下单购买等）
+2. 优先使用效率最高的操作路径
+3. 严格按照购物流程执行：搜索→详情→加购→结算→支付
+4. 每个步骤都要有明确的验证和确认
+5. 遇到问题立即停止并报告，不要尝试跳过步骤
+6. 特别关注支付流程的完整性，确保到达真正的支付页面
+
+关键节点验证：
+- 搜索结果：确认有相关商品显示
+- 商品详情：确认规格、价格等信息正确
+- 购物车：确认商品已添加，数量和价格正确
+- 结算页面：确认收货地址、商品列表、总价计算正确
+- 支付页面：确认支付金额、支付方式正确显示
+
+常见购物操作流程及等待时间：
+- 搜索商品：打开电商APP（等待4秒加载） → 等待首页加载完成（3秒） → 点击搜索框 → 输入关键词（2秒） → 点击搜索按钮 → 等待结果加载（4秒） → 浏览结果
+- 浏览分类：打开电商APP（等待4秒加载） → 等待首页加载（3秒） → 点击分类导航 → 选择分类/子分类（等待3秒加载） → 等待页面加载（3秒） → 浏览商品
+- 查看详情：点击商品（等待3秒加载详情页） → 等待详情页加载（4秒） → 查看图片/视频 → 浏览规格/参数 → 查看评价
+- 加入购物车：选择规格（2秒） → 点击加入购物车 → 等待操作完成（3秒） → 验证添加成功提示（2秒）
+- 下单购买：进入购物车（等待3秒加载） → 选择商品（1秒） → 点击结算（等待3秒） → 确认收货地址（2秒） → 选择支付方式（2秒） → 点击提交订单（等待4秒） → 到达支付页面（等待3秒）"""
+
+FULL_EXECUTOR_PROMPT = """你是电商购物执行助手，负责精准执行购物操作。
+
+日志输出规范：
+- 只报告用户可见的操作步骤和结果
+- 使用统一的格式：[操作] 描述，如"[执行] 打开淘宝APP"
+- 详细报告购物流程进度：[搜索]、[详情]、[加购]、[结算]、[支付]
+- 报告关键验证结果：[验证:加购] 商品添加成功，[验证:结算] 到达结算页面
+- "[验证:阶段]"只用于刚刚确认完成的阶段（搜索/详情/加购/结算/支付），其他验证结果使用"[验证]"
+- 避免输出技术细节、坐标信息、内部调试数据
+- 重点报告操作成功、失败、等待状态和验证结果
+
+界面操作规范：
+1. 截图验证：每次操作前获取屏幕截图，确认界面状态
+2. 元素定位：优先使用文本内容定位，其次使用坐标位置，最后使用视觉特征
+   - 购物车相关：查找"购物车"、"加入购物车"、"去结算"等文本
+   - 支付相关：查找"结算"、"提交订单"、"立即支付"、"确认支付"等文本
+   - 数量/规格：查找"+"、"-"、"选择规格"等按钮
+3. 元素预查：操作前验证元素是否存在
+   - 检查元素是否在当前界面可见
+   - 确认元素是否可点击或可编辑
+   - 验证界面是否已完全加载（检查关键元素出现）
+4. 点击精度：确保点击位置准确，避免误触，使用元素中心点点击
+5. 等待机制：操作后等待界面响应完成再进行下一步，不同操作使用不同等待时间
+   - 页面跳转：3-4秒
+   - 网络请求：2-3秒
+   - 界面动画：1-2秒
+6. 状态检查：验证操作是否成功执行，通过界面变化或提示信息确认
+   - 检查URL变化或页面标题变化
+   - 查找成功提示信息
+   - 验证关键元素状态变化
+7. 重试策略：操作失败时按以下顺序重试：
+   - 重新获取界面截图，确认元素是否仍然存在
+   - 尝试备用定位方法（文本→坐标→视觉特征）
+   - 等待更长时间后重试（每次增加1秒）
+   - 向上滑动或刷新页面后重试
+   - 如多次失败，报告具体错误信息
+
+执行要求：
+- 严格按照manager_system的指示执行
+- 每个操作都要有明确的成功验证
+- 遇到异常立即停止并详细报告
+- 保持操作序列的连续性和准确性
+
+操作后验证机制：
+- 界面变化验证：检查界面是否按预期变化（如页面跳转、元素出现/消失）
+  - 购物车：检查商品是否成功添加，数量是否正确
+  - 结算页面：检查商品列表、价格计算是否正确
+  - 支付页面：检查支付金额、支付方式是否正确显示
+- 状态反馈验证：查看是否有成功提示、错误提示或加载状态
+  - 查找"添加成功"、"提交成功"等提示信息
+  - 检查错误提示并立即停止操作
+- 元素状态验证：确认相关元素状态是否正确更新
+  - 按钮状态变化（可点击→不可点击→完成）
+  - 文本内容更新（数量、价格等）
+- 连续性验证：确保操作序列的逻辑连贯性
+  - 验证每个步骤的输出是否作为下一步的输入
+  - 检查页面跳转是否正确
+- 结果确认：最终确认整体操作目标是否达成
+  - 购物车：确认商品已添加且数量正确
+  - 结算：确认订单信息完整
+  - 支付：确认到达支付页面并显示正确金额
+
+特别注意：
+- 支付步骤前必须暂停，等待用户确认支付密码等信息
+- 所有操作都要在合理时间内完成，避免超时
+- 如遇到网络问题、界面异常或操作失败要立即报告
+- 遇到登录过期、验证码等特殊情况要及时处理"""
+
+# 精简提示词的公共部分
+_COMPACT_RULES = """日志格式："[操作类型] 描述"，只报告关键步骤和验证结果，不输出坐标和调试信息。
+元素定位：优先按文本，其次按位置；操作前确认元素可见可点击。
+失败时最多重试3次（等待后重试→换定位方式→返回重进），仍失败则停止并报告原因。
+支付步骤前必须暂停，不要输入支付密码，提示用户自行支付。
+阶段确认完成后输出"[验证:阶段] 描述"，阶段为 搜索/详情/加购/结算/支付 之一，只写刚完成的阶段。"""
+
+_COMPACT_EXECUTOR = """你是电商购物执行助手，严格按manager的指示逐步操作。
+""" + _COMPACT_RULES + """
+每步操作后通过界面变化或提示确认成功；遇到登录过期、验证码、网络异常立即报告。"""
+
+def _compact_manager(task: str, flow: str, checks: str) -> str:
+    return f"""你是电商购物助手，{task}回答简洁，只做完成目标所需的操作。
+{_COMPACT_RULES}
+流程：{flow}
+验证：{checks}"""
+
+# Scenario profiles: prompts plus wait/retry timings tuned per task type
+PROFILES = {
+    "full": {
+        "name": "完整购物流程",
+        "manager_system": FULL_MANAGER_PROMPT,
+        "executor_system": FULL_EXECUTOR_PROMPT,
+        "timings": {
+            "action_wait_time": 3.0,
+            "page_load_wait_time": 5.0,
+            "element_wait_time": 4.0,
+            "max_action_retries": 5,
+            "retry_wait_time": 2.0,
+            "max_wait_for_element": 10.0,
+        },
+    },
+    "search": {
+        "name": "搜索商品",
+        "manager_system": _compact_manager(
+            "负责在电商APP中搜索商品。",
+            "打开APP→点击搜索框→输入关键词→点击搜索→查看结果。",
+            "搜索结果页出现相关商品即完成。"
+        ),
+        "executor_system": _COMPACT_EXECUTOR,
+        "timings": {
+            "action_wait_time": 1.5,
+            "page_load_wait_time": 3.0,
+            "element_wait_time": 2.0,
+            "max_action_retries": 3,
+            "retry_wait_time": 1.0,
+            "max_wait_for_element": 6.0,
+        },
+    },
+    "browse": {
+        "name": "浏览商品",
+        "manager_system": _compact_manager(
+            "负责浏览分类或查看商品详情。",
+            "打开APP→进入分类或搜索→点击商品→查看详情、规格和评价。",
+            "详情页显示商品标题、价格和规格即完成。"
+        ),
+        "executor_system": _COMPACT_EXECUTOR,
+        "timings": {
+            "action_wait_time": 1.5,
+            "page_load_wait_time": 3.0,
+            "element_wait_time": 2.5,
+            "max_action_retries": 3,
+            "retry_wait_time": 1.0,
+            "max_wait_for_element": 6.0,
+        },
+    },
+    "cart": {
+        "name": "加入购物车",
+        "manager_system": _compact_manager(
+            "负责把商品加入购物车。",
+            "搜索→详情→选择规格→点击\"加入购物车\"→确认添加成功提示。",
+            "出现添加成功提示，或购物车中商品和数量正确即完成。"
+        ),
+        "executor_system": _COMPACT_EXECUTOR,
+        "timings": {
+            "action_wait_time": 2.0,
+            "page_load_wait_time": 3.5,
+            "element_wait_time": 3.0,
+            "max_action_retries": 4,
+            "retry_wait_time": 1.5,
+            "max_wait_for_element": 8.0,
+        },
+    },
+    "checkout": {
+        "name": "结算下单",
+        "manager_system": _compact_manager(
+            "负责结算下单，到达支付页面后必须暂停，提示用户自行支付。",
+            "购物车→勾选商品→去结算→确认收货地址和商品→提交订单→到达支付页面。",
+            "结算页地址、商品、总价正确；支付页显示金额和支付方式。"
+        ),
+        "executor_system": _COMPACT_EXECUTOR,
+        "timings": {
+            "action_wait_time": 3.0,
+            "page_load_wait_time": 5.0,
+            "element_wait_time": 4.0,
+            "max_action_retries": 5,
+            "retry_wait_time": 2.0,
+            "max_wait_for_element": 10.0,
+        },
+    },
+}
+
+# 自动选择场景时各精简配置对应的关键词；目标跨越多个阶段时使用完整流程
+_KEYWORDS = [
+    ("checkout", ["支付", "结算", "下单", "购买", "付款", "提交订单"]),
+    ("cart", ["购物车", "加购", "加入"]),
+    ("browse", ["详情", "浏览", "分类", "评价", "查看"]),
+    ("search", ["搜索", "查找", "找"]),
+]
+# 前端的"shopping"场景及未指定场景时按目标内容自动选择
+AUTO_SCENARIOS = {None, "", "shopping", "auto"}
+
+_CJK = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+# tiktoken加载编码表较慢（首次还可能联网下载），延迟到第一次统计token时再加载
+_encoding_lock = threading.Lock()
+_encoding_cache = []
+
+def _encoding():
+    """cl100k_base encoding, or None when tiktoken is not installed"""
+    with _encoding_lock:
+        if not _encoding_cache:
+            try:
+                import tiktoken
+                _encoding_cache.append(tiktoken.get_encoding("cl100k_base"))
+            except Exception:
+                _encoding_cache.append(None)
+        return _encoding_cache[0]
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, otherwise a CJK-aware estimate"""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def profile_tokens(profile: dict) -> dict:
+    """Prompt token counts, computed on first use and cached on the profile"""
+    if "tokens" not in profile:
+        manager_tokens = count_tokens(profile["manager_system"])
+        executor_tokens = count_tokens(profile["executor_system"])
+        profile["tokens"] = {
+            "manager_system": manager_tokens,
+            "executor_system": executor_tokens,
+            "total": manager_tokens + executor_tokens,
+            "method": "tiktoken" if _encoding() is not None else "estimate",
+        }
+    return profile["tokens"]
+
+for _profile_id, _profile in PROFILES.items():
+    _profile["id"] = _profile_id
+
+def resolve_profile(scenario: str = None, goal: str = "") -> dict:
+    """Pick the profile for a scenario, inferring it from the goal for generic scenarios"""
+    if scenario in PROFILES:
+        return PROFILES[scenario]
+    if scenario in AUTO_SCENARIOS:
+        # 如"搜索iPhone并购买"同时涉及搜索和结算，精简配置会跳过中间步骤
+        matched = [profile_id for profile_id, keywords in _KEYWORDS if any(keyword in (goal or "") for keyword in keywords)]
+        if len(matched) == 1:
+            return PROFILES[matched[0]]
+    return PROFILES["full"]
+
+def list_profiles() -> list[dict]:
+    """Profiles without prompt text, with per-profile token counts"""
+    return [
+        {"id": p["id"], "name": p["name"], "timings": p["timings"], "tokens": profile_tokens(p)}
+        for p in PROFILES.values()
+    ]
@@ -0,0 +1,287 @@
+import sqlite3
+import threading
+import time
+import json
+import datetime
+
+DB_PATH = 'droidrun.db'
+
+# 任务租约和重试设置
+LEASE_SECONDS = 120  # 领取任务后多久未心跳视为worker失联
+MAX_ATTEMPTS = 3  # 超过该次数后进入死信
+BACKOFF_BASE = 5.0  # 第一次重试的等待秒数，之后按指数增长
+BACKOFF_MAX = 300.0
+
+# Task states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+DEAD = 'dead'
+CANCELLED = 'cancelled'
+
+# 与 db.py 不同，队列使用一个长连接（WAL模式），避免每次操作都 connect/commit/close
+_conn = None
+_lock = threading.Lock()
+
+def _get_connection():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA busy_timeout=5000")
+    return _conn
+
+def _now_iso():
+    return datetime.datetime.now().isoformat()
+
+def _row_to_task(row):
+    task = dict(row)
+    task["payload"] = json.loads(task["payload"]) if task["payload"] else {}
+    task["result"] = json.loads(task["result"]) if task["result"] else None
+    return task
+
+def _backoff(attempts: int) -> float:
+    """Delay before the next attempt, doubling per failed attempt"""
+    return min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+
+# Initialize task table
+def init_queue():
+    with _lock:
+        conn = _get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                action TEXT NOT NULL,
+                scenario TEXT,
+                payload TEXT,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_expires_at REAL,
+                worker_id TEXT,
+                last_error TEXT,
+                result TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_claim
+            ON tasks (status, priority DESC, available_at, id)
+        ''')
+
+# Queue operations
+def submit(action: str, scenario: str = None, priority: int = 0, max_attempts: int = MAX_ATTEMPTS, payload: dict = None) -> int:
+    """Enqueue a single task and return its id"""
+    return submit_many([{
+        "action": action,
+        "scenario": scenario,
+        "priority": priority,
+        "max_attempts": max_attempts,
+        "payload": payload,
+    }])[0]
+
+def submit_many(items: list[dict]) -> list[int]:
+    """Enqueue several tasks in one transaction and return their ids"""
+    now = time.time()
+    timestamp = _now_iso()
+    rows = [
+        (
+            item["action"],
+            item.get("scenario"),
+            json.dumps(item.get("payload") or {}, ensure_ascii=False),
+            QUEUED,
+            item.get("priority") or 0,
+            item.get("max_attempts") or MAX_ATTEMPTS,
+            now,
+            timestamp,
+            timestamp,
+        )
+        for item in items
+    ]
+    with _lock:
+        conn = _get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [
+                conn.execute(
+                    "INSERT INTO tasks (action, scenario, payload, status, priority, max_attempts, available_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row
+                ).lastrowid
+                for row in rows
+            ]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return ids
+
+def claim(worker_id: str, batch_size: int = 1, lease_seconds: float = LEASE_SECONDS) -> list[dict]:
+    """Claim up to batch_size runnable tasks, including ones whose lease has expired; attempts count on start()"""
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 租约过期且已用完重试次数的任务直接进入死信，避免反复拖垮worker
+            conn.execute(
+                "UPDATE tasks SET status = ?, last_error = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+                (DEAD, "Lease expired", _now_iso(), RUNNING, now)
+            )
+            cursor = conn.execute(
+                "SELECT id FROM tasks "
+                "WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires_at < ?) "
+                "ORDER BY priority DESC, available_at, id LIMIT ?",
+                (QUEUED, now, RUNNING, now, batch_size)
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                conn.execute("COMMIT")
+                return []
+            placeholders = ",".join("?" * len(ids))
+            conn.execute(
+                f"UPDATE tasks SET status = ?, worker_id = ?, lease_expires_at = ?, updated_at = ? "
+                f"WHERE id IN ({placeholders})",
+                (RUNNING, worker_id, now + lease_seconds, _now_iso(), *ids)
+            )
+            cursor = conn.execute(f"SELECT * FROM tasks WHERE id IN ({placeholders}) ORDER BY priority DESC, id", ids)
+            tasks = [_row_to_task(row) for row in cursor.fetchall()]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return tasks
+
+def heartbeat(task_ids: list[int], worker_id: str, lease_seconds: float = LEASE_SECONDS) -> int:
+    """Extend the lease of tasks still owned by worker_id, returns the number extended"""
+    if not task_ids:
+        return 0
+    placeholders = ",".join("?" * len(task_ids))
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(
+            f"UPDATE tasks SET lease_expires_at = ?, updated_at = ? "
+            f"WHERE status = ? AND worker_id = ? AND id IN ({placeholders})",
+            (time.time() + lease_seconds, _now_iso(), RUNNING, worker_id, *task_ids)
+        )
+        return cursor.rowcount
+
+def start(task_id: int, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> dict | None:
+    """Count an attempt when the worker actually begins a task; None if the worker no longer owns it"""
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(
+            "UPDATE tasks SET attempts = attempts + 1, lease_expires_at = ?, updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker_id = ?",
+            (time.time() + lease_seconds, _now_iso(), task_id, RUNNING, worker_id)
+        )
+        if cursor.rowcount != 1:
+            return None
+        row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return _row_to_task(row)
+
+def complete(task_id: int, worker_id: str, result: dict = None) -> bool:
+    """Mark a task done; returns False if the worker no longer owns it"""
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(
+            "UPDATE tasks SET status = ?, result = ?, lease_expires_at = NULL, updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker_id = ?",
+            (DONE, json.dumps(result or {}, ensure_ascii=False), _now_iso(), task_id, RUNNING, worker_id)
+        )
+        return cursor.rowcount == 1
+
+def fail(task_id: int, worker_id: str, error: str, result: dict = None) -> str | None:
+    """Record a failed attempt; requeue with backoff or dead-letter it. Returns the new status"""
+    with _lock:
+        conn = _get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM tasks WHERE id = ? AND status = ? AND worker_id = ?",
+                (task_id, RUNNING, worker_id)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            attempts, max_attempts = row
+            status = DEAD if attempts >= max_attempts else QUEUED
+            conn.execute(
+                "UPDATE tasks SET status = ?, available_at = ?, last_error = ?, result = ?, "
+                "worker_id = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (
+                    status,
+                    time.time() + _backoff(attempts),
+                    error,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    _now_iso(),
+                    task_id,
+                )
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return status
+
+def release(task_ids: list[int], worker_id: str) -> int:
+    """Return claimed tasks that were never started to the queue"""
+    if not task_ids:
+        return 0
+    placeholders = ",".join("?" * len(task_ids))
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(
+            f"UPDATE tasks SET status = ?, worker_id = NULL, "
+            f"lease_expires_at = NULL, updated_at = ? WHERE status = ? AND worker_id = ? AND id IN ({placeholders})",
+            (QUEUED, _now_iso(), RUNNING, worker_id, *task_ids)
+        )
+        return cursor.rowcount
+
+def requeue(task_id: int) -> bool:
+    """Put a dead or cancelled task back in the queue with a fresh attempt budget"""
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(
+            "UPDATE tasks SET status = ?, attempts = 0, available_at = ?, worker_id = NULL, "
+            "lease_expires_at = NULL, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (QUEUED, time.time(), _now_iso(), task_id, DEAD, CANCELLED)
+        )
+        return cursor.rowcount == 1
+
+def cancel(task_id: int) -> bool:
+    """Cancel a task that has not been claimed yet"""
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(
+            "UPDATE tasks SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, _now_iso(), task_id, QUEUED)
+        )
+        return cursor.rowcount == 1
+
+def get_task(task_id: int) -> dict | None:
+    with _lock:
+        row = _get_connection().execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    return _row_to_task(row) if row else None
+
+def list_tasks(status: str = None, limit: int = 100) -> list[dict]:
+    with _lock:
+        conn = _get_connection()
+        if status:
+            cursor = conn.execute("SELECT * FROM tasks WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit))
+        else:
+            cursor = conn.execute("SELECT * FROM tasks ORDER BY id DESC LIMIT ?", (limit,))
+        return [_row_to_task(row) for row in cursor.fetchall()]
+
+def get_stats() -> dict:
+    """Count tasks per status"""
+    with _lock:
+        cursor = _get_connection().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status")
+        counts = {status: count for status, count in cursor.fetchall()}
+    return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, DEAD, CANCELLED)}
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import time
+from device import run_adb_command_async
+
+PORTAL_STATE_URI = "content://com.droidrun.portal/state"
+DEFAULT_MAX_AGE = 1.0  # seconds a snapshot is served without asking the device again
+
+class UIError(Exception):
+    pass
+
+def _parse_bounds(bounds) -> tuple | None:
+    """Portal reports bounds as "l, t, r, b"; accept lists/dicts too"""
+    if isinstance(bounds, str):
+        try:
+            values = [int(float(v)) for v in bounds.replace('[', ' ').replace(']', ' ').replace(',', ' ').split()]
+        except ValueError:
+            return None
+        return tuple(values) if len(values) == 4 else None
+    if isinstance(bounds, (list, tuple)) and len(bounds) == 4:
+        return tuple(int(v) for v in bounds)
+    if isinstance(bounds, dict):
+        try:
+            return (bounds["left"], bounds["top"], bounds["right"], bounds["bottom"])
+        except KeyError:
+            return None
+    return None
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+class UISnapshot:
+    """A parsed accessibility tree indexed by text, resource id and bounds"""
+
+    def __init__(self, device_id: str, tree: list, phone_state: dict, digest: str):
+        self.device_id = device_id
+        self.phone_state = phone_state or {}
+        self.digest = digest
+        self.captured_at = time.time()
+        self.elements = []
+        self.by_text = {}
+        self.by_resource_id = {}
+        self._flatten(tree, None)
+
+    def _flatten(self, nodes: list, parent: int | None):
+        for node in nodes or []:
+            element = {
+                "index": node.get("index", len(self.elements)),
+                "text": node.get("text") or "",
+                "resource_id": node.get("resourceId") or node.get("resource_id") or "",
+                "class_name": node.get("className") or node.get("class_name") or "",
+                "bounds": _parse_bounds(node.get("bounds")),
+                "parent": parent,
+            }
+            position = len(self.elements)
+            self.elements.append(element)
+            if element["text"]:
+                self.by_text.setdefault(_normalize(element["text"]), []).append(position)
+            if element["resource_id"]:
+                self.by_resource_id.setdefault(element["resource_id"], []).append(position)
+            self._flatten(node.get("children"), element["index"])
+
+    def find(self, text: str = None, resource_id: str = None, exact: bool = True) -> list[dict]:
+        """Look elements up through the indexes instead of walking the tree"""
+        positions = None
+        if text:
+            key = _normalize(text)
+            if exact:
+                positions = set(self.by_text.get(key, []))
+            else:
+                # 只扫描文本索引的键，而不是整棵树
+                positions = {p for k, ps in self.by_text.items() if key in k for p in ps}
+        if resource_id:
+            matches = set(self.by_resource_id.get(resource_id, []))
+            positions = matches if positions is None else positions & matches
+        return [self.elements[p] for p in sorted(positions or [])]
+
+    def at(self, x: int, y: int) -> list[dict]:
+        """Elements whose bounds contain the point, innermost (smallest) first"""
+        hits = [
+            e for e in self.elements
+            if e["bounds"] and e["bounds"][0] <= x <= e["bounds"][2] and e["bounds"][1] <= y <= e["bounds"][3]
+        ]
+        return sorted(hits, key=lambda e: (e["bounds"][2] - e["bounds"][0]) * (e["bounds"][3] - e["bounds"][1]))
+
+    def text_markers(self, count: int = 10, max_length: int = 12) -> list[str]:
+        """Short texts on screen, used as a cheap fingerprint of the page"""
+        markers = []
+        for text in self.by_text:
+            if len(text) <= max_length:
+                markers.append(text)
+            if len(markers) >= count:
+                break
+        return markers
+
+    def matches_markers(self, markers: list[str], ratio: float = 0.5) -> bool:
+        """Whether at least ratio of the recorded markers are still on screen"""
+        if not markers:
+            return True
+        found = sum(1 for marker in markers if marker in self.by_text)
+        return found / len(markers) >= ratio
+
+    def to_dict(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "digest": self.digest,
+            "captured_at": self.captured_at,
+            "phone_state": self.phone_state,
+            "elements": self.elements,
+        }
+
+def _element_key(element: dict) -> tuple:
+    return (element["class_name"], element["resource_id"], element["text"])
+
+def diff_snapshots(previous: UISnapshot | None, current: UISnapshot) -> dict:
+    """Elements added, removed or moved since the previous snapshot"""
+    if previous is None:
+        return {"changed": True, "added": current.elements, "removed": [], "moved": []}
+    if previous.digest == current.digest:
+        return {"changed": False, "added": [], "removed": [], "moved": []}
+
+    old = {}
+    for element in previous.elements:
+        old.setdefault(_element_key(element), []).append(element)
+    added, moved = [], []
+    for element in current.elements:
+        candidates = old.get(_element_key(element))
+        if not candidates:
+            added.append(element)
+            continue
+        match = candidates.pop(0)
+        if match["bounds"] != element["bounds"]:
+            moved.append({"element": element, "previous_bounds": match["bounds"]})
+    removed = [element for elements in old.values() for element in elements]
+    return {"changed": True, "added": added, "removed": removed, "moved": moved}
+
+async def fetch_state(device_id: str, known_digest: str = None) -> tuple[list | None, dict | None, str]:
+    """Read the accessibility tree and phone state from the Portal; skips parsing when the digest equals known_digest"""
+    success, stdout, stderr = await run_adb_command_async(
+        ['-s', device_id, 'shell', 'content', 'query', '--uri', PORTAL_STATE_URI]
+    )
+    if not success:
+        raise UIError(f"Failed to query Portal: {stderr or stdout}")
+
+    # 输出格式: Row: 0 result={"status":"success","data":"{...}"}
+    start = stdout.find('{')
+    if start == -1:
+        raise UIError("Portal returned no state; is the Portal app running with accessibility enabled?")
+    raw = stdout[start:]
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    if digest == known_digest:
+        return None, None, digest
+    try:
+        payload = json.loads(raw)
+        data = payload.get("data", payload)
+        if isinstance(data, str):
+            data = json.loads(data)
+    except json.JSONDecodeError as e:
+        raise UIError(f"Invalid Portal state: {e}")
+    return data.get("a11y_tree", []), data.get("phone_state", {}), digest
+
+# Per-device cache
+_snapshots = {}
+_diffs = {}
+_locks = {}
+
+async def get_snapshot(device_id: str, max_age: float = DEFAULT_MAX_AGE) -> UISnapshot:
+    """Return a cached snapshot, refreshing it when older than max_age"""
+    lock = _locks.setdefault(device_id, asyncio.Lock())
+    # 同一设备的并发请求只触发一次抓取
+    async with lock:
+        snapshot = _snapshots.get(device_id)
+        if snapshot and time.time() - snapshot.captured_at <= max_age:
+            return snapshot
+
+        tree, phone_state, digest = await fetch_state(device_id, snapshot.digest if snapshot else None)
+        if snapshot and snapshot.digest == digest:
+            # 界面未变化，跳过JSON解析并复用已建立的索引
+            snapshot.captured_at = time.time()
+            _diffs[device_id] = diff_snapshots(snapshot, snapshot)
+            return snapshot
+
+        previous = snapshot
+        snapshot = UISnapshot(device_id, tree, phone_state, digest)
+        _snapshots[device_id] = snapshot
+        _diffs[device_id] = diff_snapshots(previous, snapshot)
+        return snapshot
+
+def get_diff(device_id: str) -> dict:
+    """Diff computed by the last refresh against the snapshot before it"""
+    return _diffs.get(device_id, {"changed": False, "added": [], "removed": [], "moved": []})
+
+def invalidate(device_id: str = None):
+    """Force the next lookup to query the device, e.g. after an action changed the screen"""
+    if device_id is None:
+        for snapshot in _snapshots.values():
+            snapshot.captured_at = 0
+    elif device_id in _snapshots:
+        _snapshots[device_id].captured_at = 0
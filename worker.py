@@ -0,0 +1,124 @@
+import asyncio
+import uuid
+import action
+import admission
+import log
+import db
+import taskqueue
+
+HEARTBEAT_INTERVAL = 30  # seconds, well inside taskqueue.LEASE_SECONDS
+POLL_INTERVAL = 2  # seconds to wait when the queue is empty
+
+async def _heartbeat_loop(worker_id: str, task_ids: set, stop_event: asyncio.Event):
+    """Keep extending leases of the tasks this worker is still running"""
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            # 单次续期失败（如数据库锁超时）不能让循环退出，否则租约过期后任务会被重复执行
+            try:
+                taskqueue.heartbeat(list(task_ids), worker_id)
+            except Exception as e:
+                print(f"Task heartbeat failed: {e}")
+
+async def _run_task(task: dict) -> dict:
+    """Run one queued task through the agent, discarding the streamed logs"""
+    # 队列任务按批量优先级占用执行槽位，不受排队上限限制
+    ticket = admission.controller.enqueue("task-worker", admission.BATCH, bounded=False)
+    try:
+        await ticket.wait()
+        log_queue = asyncio.Queue()
+        done_event = asyncio.Event()
+        execution_task = asyncio.create_task(
+            # 重试时从上次已验证的阶段继续
+            action.stream_execute_droidrun_action(
+                task["action"], log_queue, done_event, task["scenario"],
+                run_id=f"task-{task['id']}", resume=task["attempts"] > 1
+            )
+        )
+        async for _ in log.log_generator(log_queue, done_event):
+            pass
+        return await execution_task
+    finally:
+        ticket.release()
+
+async def _process(worker_id: str, task: dict, task_ids: set):
+    # 真正开始执行时才计入一次尝试，已领取但未开始的任务不消耗重试次数
+    try:
+        started = taskqueue.start(task["id"], worker_id)
+    except Exception as e:
+        print(f"Task start failed: {e}")
+        started = None
+    if started is None:
+        task_ids.discard(task["id"])
+        return
+
+    try:
+        result = await _run_task(started)
+    except Exception as e:
+        result = {"success": False, "reason": str(e), "steps": 0}
+    finally:
+        task_ids.discard(task["id"])
+
+    # 写库失败（如数据库锁超时）只记录日志，任务由租约过期后重新领取
+    try:
+        if result["success"]:
+            if taskqueue.complete(task["id"], worker_id, result):
+                db.add_history(action=task["action"], success=True, reason=result["reason"])
+        else:
+            status = taskqueue.fail(task["id"], worker_id, result["reason"], result)
+            # 只有最终失败（进入死信）才记录到历史
+            if status == taskqueue.DEAD:
+                db.add_history(action=task["action"], success=False, reason=result["reason"])
+    except Exception as e:
+        print(f"Task completion failed: {e}")
+
+def _release_unstarted(worker_id: str, task_ids: set, started: set):
+    unstarted = [task_id for task_id in task_ids if task_id not in started]
+    started.clear()
+    if not unstarted:
+        return
+    try:
+        taskqueue.release(unstarted, worker_id)
+    except Exception as e:
+        print(f"Task release failed: {e}")
+    task_ids.difference_update(unstarted)
+
+async def run_worker(worker_id: str = None, batch_size: int = 1, stop_event: asyncio.Event = None):
+    """Claim tasks in batches from the persistent queue and execute them"""
+    worker_id = worker_id or f"worker-{uuid.uuid4().hex[:8]}"
+    stop_event = stop_event or asyncio.Event()
+    task_ids = set()
+    started = set()
+    heartbeat = asyncio.create_task(_heartbeat_loop(worker_id, task_ids, stop_event))
+    print(f"Task worker {worker_id} started")
+
+    try:
+        while not stop_event.is_set():
+            try:
+                tasks = taskqueue.claim(worker_id, batch_size)
+            except Exception as e:
+                print(f"Task claim failed: {e}")
+                tasks = []
+
+            if not tasks:
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task_ids.update(task["id"] for task in tasks)
+            # 批次内任务依次执行，租约由心跳循环统一续期
+            for task in tasks:
+                if stop_event.is_set():
+                    break
+                started.add(task["id"])
+                await _process(worker_id, task, task_ids)
+            _release_unstarted(worker_id, task_ids, started)
+    finally:
+        stop_event.set()
+        await heartbeat
+        # 停止时把已领取但未开始的任务退回队列，不计入重试次数
+        _release_unstarted(worker_id, task_ids, started)
+        print(f"Task worker {worker_id} stopped")